@@ -1,13 +1,18 @@
 import os
+import sys
+import io
+import csv
 import base64
 from typing import Optional
 
 from fastapi import FastAPI, Depends, HTTPException, status, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse, Response, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse, Response, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 
 import asyncio
+import functools
+import time
 from datetime import datetime
 from decimal import Decimal
 import aiosqlite
@@ -15,16 +20,20 @@ import httpx
 
 from db import Database
 
+# Process-wide facts shown on /debug; they don't change after startup.
+_PY_VERSION = sys.version
+_CWD = os.getcwd()
 
-def get_basic_auth_credentials() -> tuple[str, str]:
-    username = os.getenv("ADMIN_WEB_USER", "admin")
-    password = os.getenv("ADMIN_WEB_PASS", "change-me")
-    return username, password
+
+# Settings read once at import; they never change during the process lifetime.
+_ADMIN_USER = os.getenv("ADMIN_WEB_USER", "admin")
+_ADMIN_PASS = os.getenv("ADMIN_WEB_PASS", "change-me")
+_DB_PATH = os.getenv("DATABASE_PATH", "/tmp/bot.db")
+_BOT_API_BASE = os.getenv("BOT_API_BASE", "http://localhost:8000")  # Bot's API base URL
 
 
 def basic_auth_dependency(request: Request):
     auth_header: Optional[str] = request.headers.get("Authorization")
-    username, password = get_basic_auth_credentials()
 
     if not auth_header or not auth_header.startswith("Basic "):
         raise HTTPException(
@@ -44,7 +53,7 @@ def basic_auth_dependency(request: Request):
             headers={"WWW-Authenticate": "Basic"},
         )
 
-    if provided_user != username or provided_pass != password:
+    if provided_user != _ADMIN_USER or provided_pass != _ADMIN_PASS:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials",
@@ -64,7 +73,7 @@ def create_app() -> FastAPI:
         app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
     # Database instance (reuse same db file)
-    db_path = os.getenv("DATABASE_PATH", "/tmp/bot.db")
+    db_path = _DB_PATH
     print(f"Database path: {db_path}")
 
     # Check if database file exists
@@ -74,20 +83,20 @@ def create_app() -> FastAPI:
 
         # Always try to create database instance
         database = Database(db_path)
+        db_exists = os.path.exists(db_path)
         print(f"Database initialized successfully: {db_path}")
     except Exception as e:
         print(f"Error initializing database: {e}")
         # Create empty database instance as fallback
         database = None
+        db_exists = False
 
     # API Integration functions
-    BOT_API_BASE = os.getenv("BOT_API_BASE", "http://localhost:8000")  # Bot's API base URL
-
     async def fetch_from_bot(endpoint: str) -> dict:
         """Fetch data from bot's API"""
         try:
             async with httpx.AsyncClient(timeout=10.0) as client:
-                url = f"{BOT_API_BASE}/api{endpoint}"
+                url = f"{_BOT_API_BASE}/api{endpoint}"
                 response = await client.get(url)
                 response.raise_for_status()
                 return response.json()
@@ -98,16 +107,67 @@ def create_app() -> FastAPI:
     # Helper functions for database operations
     from contextlib import asynccontextmanager
 
+    # Long-lived connections shared by every request: opening a new aiosqlite
+    # connection per request spawns a thread and drops SQLite's page cache.
+    # Pages only read, so they get a read-only connection; the few writers
+    # (sync, delete) share a separate read-write one.
+    app.state.db = None
+    app.state.db_ro = None
+    # Applied as one script per connection: one thread hop instead of one per PRAGMA
+    WRITER_PRAGMAS = "PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;"
+    READER_PRAGMAS = "PRAGMA temp_store=MEMORY;PRAGMA cache_size=-64000;PRAGMA mmap_size=268435456;PRAGMA busy_timeout=5000;"
+    db_connect_lock = asyncio.Lock()
+    # Held for a whole write request so its transaction can't interleave with another's
+    db_write_lock = asyncio.Lock()
+
+    async def get_shared_connection(db, write=False):
+        """Return the shared connection, opening and tuning it on first use"""
+        attr = "db" if write else "db_ro"
+        if getattr(app.state, attr) is None:
+            async with db_connect_lock:
+                if getattr(app.state, attr) is None:
+                    if write:
+                        conn = await aiosqlite.connect(db.db_path)
+                        await conn.executescript(WRITER_PRAGMAS + READER_PRAGMAS)
+                    else:
+                        conn = await aiosqlite.connect(f"file:{db.db_path}?mode=ro", uri=True)
+                        await conn.executescript(READER_PRAGMAS)
+                    setattr(app.state, attr, conn)
+        return getattr(app.state, attr)
+
+    @app.on_event("startup")
+    async def open_database():
+        if database is not None:
+            try:
+                await get_shared_connection(database, write=True)
+                await get_shared_connection(database)
+            except Exception as e:
+                print(f"Error opening database connection: {e}")
+
+    @app.on_event("shutdown")
+    async def close_database():
+        for attr in ("db", "db_ro"):
+            conn = getattr(app.state, attr)
+            if conn is not None:
+                await conn.close()
+                setattr(app.state, attr, None)
+
     @asynccontextmanager
-    async def database_connection(db):
-        """Context manager for database connections"""
+    async def database_connection(db, write=False):
+        """Context manager lending out a shared database connection"""
         if db is None:
             raise Exception("Database not initialized")
-        conn = await aiosqlite.connect(db.db_path)
-        try:
+        conn = await get_shared_connection(db, write)
+        if not write:
             yield conn
-        finally:
-            await conn.close()
+            return
+        async with db_write_lock:
+            try:
+                yield conn
+            except Exception:
+                # Don't leave a half-done write pending on the shared connection
+                await conn.rollback()
+                raise
 
     async def count_query(conn, query, params=None):
         """Execute count query and return result"""
@@ -129,6 +189,19 @@ def create_app() -> FastAPI:
             print(f"Fetch all error: {e}")
             return []
 
+    async def fetch_all_iter(conn, query, params=None, batch_size=1024):
+        """Execute query and yield rows in fetchmany batches (bounded memory)"""
+        cursor = await conn.execute(query, params or ())
+        try:
+            while True:
+                batch = await cursor.fetchmany(batch_size)
+                if not batch:
+                    return
+                for row in batch:
+                    yield row
+        finally:
+            await cursor.close()
+
     async def fetch_one(conn, query, params=None):
         """Execute query and return single result"""
         try:
@@ -147,13 +220,12 @@ def create_app() -> FastAPI:
     async def debug():
         """Debug endpoint to check database connection"""
         debug_info = []
-        debug_info.append(f"Python version: {__import__('sys').version}")
-        debug_info.append(f"Current working directory: {__import__('os').getcwd()}")
+        debug_info.append(f"Python version: {_PY_VERSION}")
+        debug_info.append(f"Current working directory: {_CWD}")
 
-        # Check database
-        db_path = os.getenv("DATABASE_PATH", "/tmp/bot.db")
+        # Check database (existence is checked once at startup, not per request)
         debug_info.append(f"Database path: {db_path}")
-        debug_info.append(f"Database file exists: {__import__('os').path.exists(db_path)}")
+        debug_info.append(f"Database file exists (at startup): {db_exists}")
 
         # Try to initialize database
         if database is not None:
@@ -381,7 +453,7 @@ def create_app() -> FastAPI:
 
                 # Insert into Vercel database
                 if database is not None:
-                    async with database_connection(database) as vercel_conn:
+                    async with database_connection(database, write=True) as vercel_conn:
                         # Clear existing users
                         await vercel_conn.execute("DELETE FROM users")
 
@@ -438,7 +510,7 @@ def create_app() -> FastAPI:
 
                 # Insert into Vercel database
                 if database is not None:
-                    async with database_connection(database) as vercel_conn:
+                    async with database_connection(database, write=True) as vercel_conn:
                         # Clear existing expenses
                         await vercel_conn.execute("DELETE FROM expenses")
 
@@ -491,7 +563,7 @@ def create_app() -> FastAPI:
                 if bot_users and "users" in bot_users:
                     users_data = bot_users["users"]
                     if database is not None:
-                        async with database_connection(database) as vercel_conn:
+                        async with database_connection(database, write=True) as vercel_conn:
                             await vercel_conn.execute("DELETE FROM users")
                             for user in users_data:
                                 await vercel_conn.execute("""
@@ -512,7 +584,7 @@ def create_app() -> FastAPI:
                 if bot_expenses and "expenses" in bot_expenses:
                     expenses_data = bot_expenses["expenses"]
                     if database is not None:
-                        async with database_connection(database) as vercel_conn:
+                        async with database_connection(database, write=True) as vercel_conn:
                             await vercel_conn.execute("DELETE FROM expenses")
                             for expense in expenses_data:
                                 await vercel_conn.execute("""
@@ -534,7 +606,7 @@ def create_app() -> FastAPI:
                 if bot_trips and "trips" in bot_trips:
                     trips_data = bot_trips["trips"]
                     if database is not None:
-                        async with database_connection(database) as vercel_conn:
+                        async with database_connection(database, write=True) as vercel_conn:
                             await vercel_conn.execute("DELETE FROM trips")
                             for trip in trips_data:
                                 await vercel_conn.execute("""
@@ -555,7 +627,7 @@ def create_app() -> FastAPI:
                 <ul>
                     {''.join([f'<li>{table}</li>' for table in tables_synced])}
                 </ul>
-                <p>Data source: Bot API ({BOT_API_BASE})</p>
+                <p>Data source: Bot API ({_BOT_API_BASE})</p>
                 <p><a href="/debug">🔧 Check Results</a> | <a href="/sync-data">🔄 Back to Sync</a></p>
             </div>
             """)
@@ -804,6 +876,38 @@ def create_app() -> FastAPI:
             "limit": limit
         })
 
+    @app.get("/expenses/export.csv")
+    async def export_expenses(_=Depends(basic_auth_dependency)):
+        """Xuất toàn bộ giao dịch ra CSV (stream từng lô, không giữ hết trong bộ nhớ)"""
+        if database is None:
+            raise HTTPException(status_code=503, detail="Database not initialized")
+
+        async def rows_as_csv():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(["id", "trip_id", "payer_user_id", "payer_name", "amount",
+                             "currency", "note", "created_at"])
+            async with database_connection(database) as conn:
+                async for row in fetch_all_iter(conn, """
+                    SELECT e.id, e.trip_id, e.payer_user_id, u.name, e.amount,
+                           e.currency, e.note, e.created_at
+                    FROM expenses e
+                    LEFT JOIN users u ON e.payer_user_id = u.id
+                    ORDER BY e.created_at DESC
+                """):
+                    writer.writerow(row)
+                    if buffer.tell() >= 65536:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+            yield buffer.getvalue()
+
+        return StreamingResponse(
+            rows_as_csv(),
+            media_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename=expenses.csv"},
+        )
+
     @app.post("/expenses/{expense_id}/delete", response_class=HTMLResponse)
     async def delete_expense(
         request: Request, 
@@ -812,7 +916,7 @@ def create_app() -> FastAPI:
     ):
         """Xóa giao dịch (hoàn tác giao dịch)"""
         try:
-            async with database_connection(database) as conn:
+            async with database_connection(database, write=True) as conn:
                 # Kiểm tra giao dịch có tồn tại không
                 expense = await fetch_one(conn, "SELECT * FROM expenses WHERE id = ?", (expense_id,))
                 if not expense:
@@ -953,21 +1057,6 @@ def create_app() -> FastAPI:
     return app
 
 
-class database_connection:
-    def __init__(self, database: Database):
-        self.database = database
-        self.conn = None
-
-    async def __aenter__(self):
-        import aiosqlite
-        self.conn = await aiosqlite.connect(self.database.db_path)
-        self.conn.row_factory = aiosqlite.Row
-        return self.conn
-
-    async def __aexit__(self, exc_type, exc, tb):
-        await self.conn.close()
-
-
 async def count_query(conn, sql: str, params: tuple = ()) -> int:
     cursor = await conn.execute(sql, params)
     row = await cursor.fetchone()
@@ -986,39 +1075,119 @@ async def fetch_one(conn, sql: str, params: tuple = ()):
     return row
 
 
+# Recently rendered log text, keyed by line count rounded up to the next 100,
+# so refresh bursts and nearby sizes (180 vs 200) share one journal read
+_LOG_CACHE_TTL = 2.0
+_log_cache: dict[int, tuple[float, str]] = {}
+_log_lock = asyncio.Lock()
+
+
 async def get_logs(lines: int = 200) -> str:
-    # Prefer journalctl for the systemd unit if available
+    if lines <= 0:
+        return ""
+    key = ((lines + 99) // 100) * 100
+
+    async with _log_lock:
+        cached = _log_cache.get(key)
+        if cached and time.monotonic() - cached[0] < _LOG_CACHE_TTL:
+            log_text = cached[1]
+        else:
+            log_text = await read_logs(key)
+            _log_cache[key] = (time.monotonic(), log_text)
+
+    if lines == key:
+        return log_text
+    return "".join(log_text.splitlines(keepends=True)[-lines:])
+
+
+@functools.cache
+def bot_log_file() -> str:
+    return os.getenv("BOT_LOG_FILE", os.path.join(os.getcwd(), "bot.log"))
+
+
+async def read_logs(lines: int) -> str:
+    # Prefer the systemd journal for the unit if available, read in-process via libsystemd
+    try:
+        journal_text = await asyncio.to_thread(read_journal, lines)
+        if journal_text is not None:
+            return journal_text
+    except Exception:
+        pass
+
+    # Fall back to journalctl when the python-systemd binding isn't installed
     try:
-        import asyncio
+        # --output=cat: the bot's log format already carries timestamps, so skip journal metadata
         proc = await asyncio.create_subprocess_exec(
-            "journalctl", "-u", "telegram-bot", "-n", str(lines), "--no-pager",
+            "journalctl", "-u", "telegram-bot", "-n", str(lines), "--no-pager", "--output=cat",
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
         )
-        stdout, stderr = await proc.communicate()
-        if proc.returncode == 0:
-            return stdout.decode("utf-8", errors="ignore")
+        chunks = [line async for line in proc.stdout]
+        if await proc.wait() == 0:
+            return b"".join(chunks).decode("utf-8", errors="ignore")
     except Exception:
         pass
 
     # Fallback to file-based log if exists
-    log_file = os.getenv("BOT_LOG_FILE", os.path.join(os.getcwd(), "bot.log"))
-    if os.path.isfile(log_file):
-        try:
-            # Read last N lines
-            return tail_file(log_file, lines)
-        except Exception:
-            with open(log_file, "r", encoding="utf-8", errors="ignore") as f:
-                return f.read()
+    log_file = bot_log_file()
+    try:
+        # Read last N lines in a worker thread so large logs don't block the event loop;
+        # a missing file is detected here rather than by a stat() per call
+        return await asyncio.to_thread(tail_file, log_file, lines)
+    except (FileNotFoundError, IsADirectoryError):
+        pass
+    except Exception:
+        return await asyncio.to_thread(read_file, log_file)
 
     return "No logs available. Ensure systemd unit name is 'telegram-bot' or set BOT_LOG_FILE."
 
 
-def tail_file(path: str, lines: int) -> str:
-    # Simple tail: read last N lines (sufficient for modest log sizes)
+def read_journal(lines: int) -> Optional[str]:
+    """Read the last N journal entries of the bot unit; None if python-systemd is missing."""
+    try:
+        from systemd import journal
+    except ImportError:
+        return None
+
+    reader = journal.Reader()
+    try:
+        reader.add_match(_SYSTEMD_UNIT="telegram-bot.service")
+        reader.seek_tail()
+        entries = []
+        for _ in range(lines):
+            entry = reader.get_previous()
+            if not entry:
+                break
+            # Message only, same as journalctl --output=cat
+            entries.append(str(entry.get("MESSAGE", "")))
+    finally:
+        reader.close()
+
+    entries.reverse()
+    return "\n".join(entries) + "\n" if entries else ""
+
+
+def read_file(path: str) -> str:
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        all_lines = f.readlines()
-        return "".join(all_lines[-lines:])
+        return f.read()
+
+
+def tail_file(path: str, lines: int, block_size: int = 65536) -> str:
+    # Read backwards from EOF in fixed blocks until enough newlines are seen,
+    # so only the tail of a large log is ever read and decoded
+    if lines <= 0:
+        return ""
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        buf = b""
+        while pos > 0 and buf.count(b"\n") <= lines:
+            read_from = max(0, pos - block_size)
+            f.seek(read_from)
+            buf = f.read(pos - read_from) + buf
+            pos = read_from
+    tail = buf.splitlines(keepends=True)[-lines:]
+    return b"".join(tail).decode("utf-8", errors="ignore")
 
 
 app = create_app()
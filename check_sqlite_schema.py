@@ -4,33 +4,41 @@ Check SQLite database schema to see what columns exist.
 """
 import sqlite3
 import sys
+from itertools import groupby
+from operator import itemgetter
 
 def check_sqlite_schema(db_path="bot.db"):
     """Check SQLite database schema."""
     try:
-        conn = sqlite3.connect(db_path)
+        # Read-only and autocommit: the schema check never writes, so skip write
+        # locking, implicit transactions and the checkpoint-on-close work
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, isolation_level=None)
         cursor = conn.cursor()
         
-        # Get all tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = cursor.fetchall()
+        # Get every table's columns in one query via the pragma_table_info table-valued function
+        cursor.execute("""
+            SELECT m.name, p.cid, p.name, p.type, p."notnull", p.dflt_value, p.pk
+            FROM sqlite_master m, pragma_table_info(m.name) p
+            WHERE m.type = 'table'
+            ORDER BY m.rowid, p.cid
+        """)
+        rows = cursor.fetchall()
         
-        print(f"📊 SQLite Database Schema ({db_path}):")
-        print("=" * 50)
+        # Build the report in memory and write it out once
+        out = [f"📊 SQLite Database Schema ({db_path}):", "=" * 50]
         
-        for (table_name,) in tables:
-            print(f"\n🗂️ Table: {table_name}")
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            columns = cursor.fetchall()
+        for table_name, columns in groupby(rows, key=itemgetter(0)):
+            out.append(f"\n🗂️ Table: {table_name}")
             
             for col_info in columns:
-                col_id, col_name, col_type, not_null, default_val, pk = col_info
+                _, col_id, col_name, col_type, not_null, default_val, pk = col_info
                 pk_marker = " (PK)" if pk else ""
                 null_marker = " NOT NULL" if not_null else ""
                 default_marker = f" DEFAULT {default_val}" if default_val else ""
-                print(f"  • {col_name} {col_type}{pk_marker}{null_marker}{default_marker}")
+                out.append(f"  • {col_name} {col_type}{pk_marker}{null_marker}{default_marker}")
         
         conn.close()
+        sys.stdout.write("\n".join(out) + "\n")
         
     except Exception as e:
         print(f"❌ Error checking schema: {e}")
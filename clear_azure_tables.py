@@ -3,21 +3,23 @@
 Clear all tables in Azure SQL Database before migration.
 Run this to clean up existing data that might conflict.
 """
-import asyncio
-import pyodbc
-from config_azure import azure_config
 
-async def clear_all_tables():
+def clear_all_tables():
     """Clear all tables in Azure SQL Database."""
     print("🧹 Clearing Azure SQL Database tables...")
     
+    from config_azure import azure_config
     if not azure_config.is_azure_configured:
         print("❌ Azure SQL not configured")
         return
     
+    # Imported only once Azure is configured: pyodbc loads the ODBC driver manager
+    import pyodbc
+    
     try:
         # Connect to Azure SQL
-        conn = pyodbc.connect(azure_config.pyodbc_connection_string)
+        # One explicit transaction for the whole wipe, committed once at the end
+        conn = pyodbc.connect(azure_config.pyodbc_connection_string, autocommit=False)
         cursor = conn.cursor()
         
         # List of tables in dependency order (reverse for deletion)
@@ -40,12 +42,24 @@ async def clear_all_tables():
         ]
         
         print("🗑️ Deleting data from tables...")
-        for table in tables:
-            try:
-                cursor.execute(f"DELETE FROM {table}")
-                print(f"✅ Cleared {table}")
-            except Exception as e:
-                print(f"⚠️ Could not clear {table}: {e}")
+        try:
+            # Send every DELETE as one batch: a single round trip instead of one per table.
+            # Missing tables are skipped server-side so they can't fail the batch.
+            cursor.execute(";\n".join(
+                f"IF OBJECT_ID('{table}', 'U') IS NOT NULL DELETE FROM {table}"
+                for table in tables
+            ))
+            print(f"✅ Cleared {', '.join(tables)}")
+        except Exception as e:
+            # Batch failed - retry table by table to see which one is the problem
+            print(f"⚠️ Batch delete failed ({e}), clearing tables one by one...")
+            conn.rollback()
+            for table in tables:
+                try:
+                    cursor.execute(f"DELETE FROM {table}")
+                    print(f"✅ Cleared {table}")
+                except Exception as e:
+                    print(f"⚠️ Could not clear {table}: {e}")
         
         # Commit all deletions
         conn.commit()
@@ -58,4 +72,4 @@ async def clear_all_tables():
             conn.close()
 
 if __name__ == "__main__":
-    asyncio.run(clear_all_tables())
+    clear_all_tables()
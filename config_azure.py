@@ -2,66 +2,96 @@
 Azure SQL Database configuration for the Telegram bot.
 """
 import os
+from dataclasses import dataclass, field
 from typing import Optional
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+@dataclass(frozen=True, slots=True)
 class AzureSQLConfig:
-    """Configuration class for Azure SQL Database."""
+    """Configuration for Azure SQL Database.
+
+    Immutable: built once from the environment at import, with the connection
+    strings formatted up front in __post_init__.
+    """
     
-    def __init__(self):
-        # Azure SQL Database connection parameters
-        self.server = os.getenv('AZURE_SQL_SERVER')  # e.g., 'your-server.database.windows.net'
-        self.database = os.getenv('AZURE_SQL_DATABASE', 'telegram_bot')
-        self.username = os.getenv('AZURE_SQL_USERNAME')
-        self.password = os.getenv('AZURE_SQL_PASSWORD')
-        self.driver = os.getenv('AZURE_SQL_DRIVER', 'ODBC Driver 18 for SQL Server')
-        
-        # Connection options
-        self.encrypt = os.getenv('AZURE_SQL_ENCRYPT', 'yes')
-        self.trust_server_certificate = os.getenv('AZURE_SQL_TRUST_CERT', 'no')
-        self.connection_timeout = int(os.getenv('AZURE_SQL_TIMEOUT', '30'))
-        
-        # Fallback to SQLite if Azure SQL not configured
-        self.use_sqlite_fallback = os.getenv('USE_SQLITE_FALLBACK', 'true').lower() == 'true'
-        self.sqlite_path = os.getenv('DATABASE_PATH', './bot.db')
+    # Azure SQL Database connection parameters
+    server: Optional[str]  # e.g., 'your-server.database.windows.net'
+    database: str
+    username: Optional[str]
+    password: Optional[str] = field(repr=False)
+    driver: str
     
-    @property
-    def is_azure_configured(self) -> bool:
-        """Check if Azure SQL Database is properly configured."""
-        return all([
+    # Connection options
+    encrypt: str
+    trust_server_certificate: str
+    connection_timeout: int
+    
+    # Fallback to SQLite if Azure SQL not configured
+    use_sqlite_fallback: bool
+    sqlite_path: str
+    
+    # Derived in __post_init__
+    is_azure_configured: bool = field(init=False)
+    _connection_string: Optional[str] = field(init=False, repr=False)
+    _pyodbc_connection_string: Optional[str] = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        configured = all([
             self.server,
             self.database, 
             self.username,
             self.password
         ])
+        object.__setattr__(self, 'is_azure_configured', configured)
+        
+        connection_string = pyodbc_connection_string = None
+        if configured:
+            connection_string = (
+                f"mssql+pyodbc://{self.username}:{self.password}@{self.server}/"
+                f"{self.database}?driver={self.driver.replace(' ', '+')}"
+                f"&encrypt={self.encrypt}&trustServerCertificate={self.trust_server_certificate}"
+            )
+            pyodbc_connection_string = (
+                f"DRIVER={{{self.driver}}};SERVER={self.server};DATABASE={self.database};"
+                f"UID={self.username};PWD={self.password};Encrypt={self.encrypt};"
+                f"TrustServerCertificate={self.trust_server_certificate};"
+                f"Connection Timeout={self.connection_timeout};"
+            )
+        object.__setattr__(self, '_connection_string', connection_string)
+        object.__setattr__(self, '_pyodbc_connection_string', pyodbc_connection_string)
     
     @property
     def connection_string(self) -> str:
-        """Generate Azure SQL Database connection string."""
-        if not self.is_azure_configured:
+        """Azure SQL Database connection string."""
+        if self._connection_string is None:
             raise ValueError("Azure SQL Database not properly configured")
-        
-        return (
-            f"mssql+pyodbc://{self.username}:{self.password}@{self.server}/"
-            f"{self.database}?driver={self.driver.replace(' ', '+')}"
-            f"&encrypt={self.encrypt}&trustServerCertificate={self.trust_server_certificate}"
-        )
+        return self._connection_string
     
     @property 
     def pyodbc_connection_string(self) -> str:
-        """Generate pyodbc connection string."""
-        if not self.is_azure_configured:
+        """pyodbc connection string."""
+        if self._pyodbc_connection_string is None:
             raise ValueError("Azure SQL Database not properly configured")
-            
-        return (
-            f"DRIVER={{{self.driver}}};SERVER={self.server};DATABASE={self.database};"
-            f"UID={self.username};PWD={self.password};Encrypt={self.encrypt};"
-            f"TrustServerCertificate={self.trust_server_certificate};"
-            f"Connection Timeout={self.connection_timeout};"
-        )
+        return self._pyodbc_connection_string
+
+
+def _build() -> AzureSQLConfig:
+    """Read the Azure SQL settings from the environment."""
+    return AzureSQLConfig(
+        server=os.getenv('AZURE_SQL_SERVER'),
+        database=os.getenv('AZURE_SQL_DATABASE', 'telegram_bot'),
+        username=os.getenv('AZURE_SQL_USERNAME'),
+        password=os.getenv('AZURE_SQL_PASSWORD'),
+        driver=os.getenv('AZURE_SQL_DRIVER', 'ODBC Driver 18 for SQL Server'),
+        encrypt=os.getenv('AZURE_SQL_ENCRYPT', 'yes'),
+        trust_server_certificate=os.getenv('AZURE_SQL_TRUST_CERT', 'no'),
+        connection_timeout=int(os.getenv('AZURE_SQL_TIMEOUT', '30')),
+        use_sqlite_fallback=os.getenv('USE_SQLITE_FALLBACK', 'true').lower() == 'true',
+        sqlite_path=os.getenv('DATABASE_PATH', './bot.db'),
+    )
 
 # Global configuration instance
-azure_config = AzureSQLConfig()
+azure_config = _build()
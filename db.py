@@ -2,29 +2,228 @@
 Database operations for the Telegram bot.
 """
 import aiosqlite
+import asyncio
+import itertools
 import logging
+from contextlib import asynccontextmanager
 from typing import List, Optional, Tuple, Dict
 from decimal import Decimal
 from datetime import datetime, timedelta
 from models import *
 import os
+import sqlite3
+import time
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
+# Decimals are immutable, so hot paths can share this instead of parsing Decimal('1') per call
+_DEC_ONE = Decimal('1')
+
+
+def _convert_datetime(value: bytes) -> Optional[datetime]:
+    """sqlite3 converter for columns selected as "name [datetime]"."""
+    try:
+        return datetime.fromisoformat(value.decode())
+    except ValueError:
+        return None
+
+
+def _convert_decimal(value: bytes) -> Decimal:
+    """sqlite3 converter for columns selected as "name [decimal]"."""
+    return Decimal(value.decode())
+
+
+sqlite3.register_converter("datetime", _convert_datetime)
+sqlite3.register_converter("decimal", _convert_decimal)
+# Money is bound as its exact decimal text; the DECIMAL columns' NUMERIC affinity stores it as a number
+sqlite3.register_adapter(Decimal, str)
+
+
+def _unpaid_participant_row(cursor, row) -> Tuple[GroupExpense, GroupExpenseParticipant, User]:
+    """Row factory for get_unpaid_participants; runs on the connection's worker thread."""
+    return GroupExpense(*row[:8]), GroupExpenseParticipant(*row[8:14]), User(*row[14:])
+
+
+# Read-only connections kept alongside the writer; under WAL they read concurrently
+READER_POOL_SIZE = 4
+
+# Bump when _migrate_columns gains a new step
+SCHEMA_VERSION = 2
+
+# Tables keyed only by a composite primary key; stored as WITHOUT ROWID
+WITHOUT_ROWID_TABLES = ("trip_members", "exchange_rates")
+
+# How often the background task refreshes query planner statistics
+OPTIMIZE_INTERVAL_SECONDS = 15 * 60
+
+# Prepared statements kept per connection (sqlite3 defaults to 128)
+STATEMENT_CACHE_SIZE = 256
+
+# Connection settings; PRAGMAs other than journal_mode=WAL do not persist in the
+# file, so every connection applies them once when it is opened
+CONNECTION_PRAGMAS = (
+    "PRAGMA cache_size=-65536;"      # 64 MiB page cache
+    "PRAGMA temp_store=MEMORY;"      # Use memory for temp
+    "PRAGMA mmap_size=10737418240;"  # Memory-mapped reads
+    "PRAGMA busy_timeout=5000;"      # Wait for locks instead of failing
+)
+READER_PRAGMAS = (
+    CONNECTION_PRAGMAS
+    + "PRAGMA query_only=ON;"        # Refuse writes misrouted to a reader
+)
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;"       # Better concurrency
+    "PRAGMA synchronous=NORMAL;"     # Faster writes
+    "PRAGMA wal_autocheckpoint=1000;"
+    + CONNECTION_PRAGMAS
+)
+
+
+async def _apply_pragmas(conn: aiosqlite.Connection, write: bool) -> None:
+    """Tune a freshly opened connection in a single round trip."""
+    await conn.executescript(WRITER_PRAGMAS if write else READER_PRAGMAS)
+
+
+# Per-user rows read on nearly every message; cached in-process for a short while
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL_SECONDS = 300
+
+# Exchange rates change rarely but are looked up on every currency conversion
+EXCHANGE_RATE_CACHE_SIZE = 256
+EXCHANGE_RATE_CACHE_TTL_SECONDS = 60
+
+# Payment preferences and group expense rows, re-read while handling callbacks
+PAYMENT_PREFERENCES_CACHE_TTL_SECONDS = 60
+EXPENSE_CACHE_SIZE = 4096
+EXPENSE_CACHE_TTL_SECONDS = 300
+
+
+class _TTLCache:
+    """Small LRU mapping whose entries expire after a fixed number of seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        self._data.pop(key, None)
+
 
 class Database:
     def __init__(self, db_path: str):
         self.db_path = db_path
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._reader_cycle = None
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        self._optimize_task: Optional[asyncio.Task] = None
+        self._users_by_tg_id = _TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+        self._user_settings = _TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+        self._exchange_rates = _TTLCache(EXCHANGE_RATE_CACHE_SIZE, EXCHANGE_RATE_CACHE_TTL_SECONDS)
+        self._latest_exchange_rates = _TTLCache(EXCHANGE_RATE_CACHE_SIZE, EXCHANGE_RATE_CACHE_TTL_SECONDS)
+        self._payment_preferences = _TTLCache(USER_CACHE_SIZE, PAYMENT_PREFERENCES_CACHE_TTL_SECONDS)
+        self._expenses_by_id = _TTLCache(EXPENSE_CACHE_SIZE, EXPENSE_CACHE_TTL_SECONDS)
+
+    async def connect(self) -> aiosqlite.Connection:
+        """Open the shared writer connection on first use and return it."""
+        if self._writer is None:
+            async with self._connect_lock:
+                if self._writer is None:
+                    conn = await aiosqlite.connect(
+                        self.db_path, cached_statements=STATEMENT_CACHE_SIZE, detect_types=sqlite3.PARSE_COLNAMES
+                    )
+                    await _apply_pragmas(conn, write=True)
+                    self._writer = conn
+        return self._writer
+
+    async def _reader(self) -> aiosqlite.Connection:
+        """Return the next read-only connection, round-robin."""
+        if not self._readers:
+            # The writer creates the file and switches it to WAL before readers attach
+            await self.connect()
+            async with self._connect_lock:
+                if not self._readers:
+                    readers = []
+                    for _ in range(READER_POOL_SIZE):
+                        conn = await aiosqlite.connect(
+                            f"file:{self.db_path}?mode=ro", uri=True,
+                            cached_statements=STATEMENT_CACHE_SIZE, detect_types=sqlite3.PARSE_COLNAMES
+                        )
+                        await _apply_pragmas(conn, write=False)
+                        readers.append(conn)
+                    self._reader_cycle = itertools.cycle(readers)
+                    self._readers = readers
+        return next(self._reader_cycle)
+
+    async def close(self):
+        """Close the writer and reader connections."""
+        if self._optimize_task is not None:
+            self._optimize_task.cancel()
+            self._optimize_task = None
+        for conn in self._readers:
+            await conn.close()
+        self._readers = []
+        self._reader_cycle = None
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def _connection(self, write: bool = False):
+        """Lend out a shared connection: the writer, or a read-only reader.
+
+        Writers are serialized so one method's commit or rollback never lands
+        on another method's half-finished statements.
+        """
+        if not write:
+            yield await self._reader()
+            return
+        db = await self.connect()
+        async with self._write_lock:
+            try:
+                yield db
+            finally:
+                # An exception or an early return without commit must not leave a
+                # transaction open on the shared writer for the next caller
+                if db.in_transaction:
+                    await db.rollback()
+
+    async def execute_read(self, query: str, params: tuple = None) -> List[tuple]:
+        """Run a SELECT on one of the read-only connections and return all rows."""
+        async with self._connection() as db:
+            return list(await db.execute_fetchall(query, params or ()))
+
+    async def execute_many(self, query: str, params_list: List[tuple]) -> int:
+        """Run one statement for every parameter tuple inside a single transaction."""
+        async with self._connection(write=True) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.executemany(query, params_list)
+            await db.commit()
+            return cursor.rowcount
 
     async def init_db(self):
         """Initialize the database with all required tables."""
-        async with aiosqlite.connect(self.db_path) as db:
-            # SQLite optimizations for better performance
-            await db.execute("PRAGMA journal_mode=WAL")      # Better concurrency
-            await db.execute("PRAGMA synchronous=NORMAL")     # Faster writes
-            await db.execute("PRAGMA cache_size=10000")       # More memory cache
-            await db.execute("PRAGMA temp_store=MEMORY")      # Use memory for temp
-            
+        async with self._connection(write=True) as db:
             # Users table
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -142,7 +341,7 @@ class Database:
                     PRIMARY KEY (trip_id, user_id),
                     FOREIGN KEY (trip_id) REFERENCES trips (id),
                     FOREIGN KEY (user_id) REFERENCES users (id)
-                )
+                ) WITHOUT ROWID
             """)
 
             # Expenses table
@@ -222,7 +421,7 @@ class Database:
                     rate DECIMAL(10,6) NOT NULL,
                     set_by TEXT,
                     PRIMARY KEY (from_currency, to_currency)
-                )
+                ) WITHOUT ROWID
             """)
 
             # Group expenses table
@@ -285,122 +484,209 @@ class Database:
                 )
             """)
 
+            # Indexes for the columns the bot filters and joins on
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_pe_user_created ON personal_expenses(user_id, created_at DESC)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_pe_user_currency_date ON personal_expenses(user_id, currency, created_at)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_uw_user ON user_wallets(user_id)")
+            await db.execute("DROP INDEX IF EXISTS idx_wa_wallet")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_wa_wallet_created ON wallet_adjustments(wallet_id, created_at DESC)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_pe_wallet_created ON personal_expenses(wallet_id, created_at DESC)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_es_expense ON expense_shares(expense_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_gep_exp_user ON group_expense_participants(expense_id, user_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_gd_group_debtor ON group_debts(group_id, debtor_user_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_gd_group_currency ON group_debts(group_id, currency)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_gd_group_pending ON group_debts(group_id) WHERE amount > 0")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_ge_payer_group_created ON group_expenses(payer_user_id, group_id, created_at DESC)")
+
+            # Every wallet_adjustments row moves its wallet's balance; rounded to the column's DECIMAL(15,2) scale
+            await db.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_wa_apply AFTER INSERT ON wallet_adjustments
+                BEGIN
+                    UPDATE user_wallets
+                    SET current_balance = ROUND(current_balance + NEW.delta_amount, 2),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = NEW.wallet_id;
+                END
+            """)
+
+            # Deleting a group expense removes its participants' shares, like ON DELETE CASCADE
+            # without switching on foreign key enforcement for the whole connection
+            await db.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_ge_delete_participants AFTER DELETE ON group_expenses
+                BEGIN
+                    DELETE FROM group_expense_participants WHERE expense_id = OLD.id;
+                END
+            """)
+
             await db.commit()
             
-            # Add undo_until column to group_expenses if not exists (migration)
-            try:
-                cursor = await db.execute("PRAGMA table_info(group_expenses)")
-                columns = await cursor.fetchall()
-                column_names = [col[1] for col in columns]
-                
-                if 'undo_until' not in column_names:
-                    await db.execute("ALTER TABLE group_expenses ADD COLUMN undo_until TIMESTAMP")
+            # Column migrations run once; PRAGMA user_version records that they were applied
+            cursor = await db.execute("PRAGMA user_version")
+            (schema_version,) = await cursor.fetchone()
+            if schema_version < SCHEMA_VERSION:
+                # Explicit BEGIN: sqlite3 only opens implicit transactions before DML, which
+                # would leave the ALTERs autocommitted and a failed run half-applied
+                await db.execute("BEGIN IMMEDIATE")
+                if await self._migrate_columns(db):
+                    await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
                     await db.commit()
-                    logger.info("Added undo_until column to group_expenses table")
-            except Exception as e:
-                logger.error(f"Error adding undo_until column: {e}")
+                else:
+                    # Leave user_version alone so the failed steps run again on next start
+                    await db.rollback()
                 
-            # Add undo_until column to personal_expenses if not exists (migration)
-            try:
-                cursor = await db.execute("PRAGMA table_info(personal_expenses)")
-                columns = await cursor.fetchall()
-                column_names = [col[1] for col in columns]
+            logger.info("Database initialized successfully")
+
+        if self._optimize_task is None:
+            self._optimize_task = asyncio.create_task(self._optimize_periodically())
+
+    async def _migrate_columns(self, db):
+        """Add columns missing from databases created by older versions.
+
+        Runs inside the transaction init_db opens, so the caller can commit or
+        roll back every step together. Returns True only if every step succeeded.
+        """
+        ok = True
+        # Add undo_until column to group_expenses if not exists (migration)
+        try:
+            cursor = await db.execute("PRAGMA table_info(group_expenses)")
+            columns = await cursor.fetchall()
+            column_names = [col[1] for col in columns]
+            
+            if 'undo_until' not in column_names:
+                await db.execute("ALTER TABLE group_expenses ADD COLUMN undo_until TIMESTAMP")
+                logger.info("Added undo_until column to group_expenses table")
+        except Exception as e:
+            logger.error(f"Error adding undo_until column: {e}")
+            ok = False
+            
+        # Add undo_until column to personal_expenses if not exists (migration)
+        try:
+            cursor = await db.execute("PRAGMA table_info(personal_expenses)")
+            columns = await cursor.fetchall()
+            column_names = [col[1] for col in columns]
+            
+            if 'undo_until' not in column_names:
+                await db.execute("ALTER TABLE personal_expenses ADD COLUMN undo_until TIMESTAMP")
+                logger.info("Added undo_until column to personal_expenses table")
                 
-                if 'undo_until' not in column_names:
-                    await db.execute("ALTER TABLE personal_expenses ADD COLUMN undo_until TIMESTAMP")
-                    await db.commit()
-                    logger.info("Added undo_until column to personal_expenses table")
-                    
-                    # Update existing expenses to have undo_until = created_at + 24 hours
-                    await db.execute("""
-                        UPDATE personal_expenses 
-                        SET undo_until = datetime(created_at, '+24 hours') 
-                        WHERE undo_until IS NULL
-                    """)
-                    await db.commit()
-                    logger.info("Updated existing personal expenses with undo_until")
+                # Update existing expenses to have undo_until = created_at + 24 hours
+                await db.execute("""
+                    UPDATE personal_expenses 
+                    SET undo_until = datetime(created_at, '+24 hours') 
+                    WHERE undo_until IS NULL
+                """)
+                logger.info("Updated existing personal expenses with undo_until")
+        except Exception as e:
+            logger.error(f"Error adding undo_until column to personal_expenses: {e}")
+            ok = False
+            
+        # Add payment_method column to group_expense_participants if not exists
+        try:
+            cursor = await db.execute("PRAGMA table_info(group_expense_participants)")
+            columns = await cursor.fetchall()
+            column_names = [col[1] for col in columns]
+            
+            if 'payment_method' not in column_names:
+                await db.execute("ALTER TABLE group_expense_participants ADD COLUMN payment_method TEXT DEFAULT 'end_of_day'")
+                logger.info("Added payment_method column to group_expense_participants table")
+        except Exception as e:
+            logger.error(f"Error adding payment_method column: {e}")
+            ok = False
+
+        # Rebuild composite-key tables created before they were WITHOUT ROWID
+        for table in WITHOUT_ROWID_TABLES:
+            try:
+                cursor = await db.execute(
+                    "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                    (table,)
+                )
+                row = await cursor.fetchone()
+                # Older layouts with a surrogate AUTOINCREMENT id must keep their rowid
+                if row is None or 'WITHOUT ROWID' in row[0].upper() or 'AUTOINCREMENT' in row[0].upper():
+                    continue
+                create_sql = row[0].replace(table, f"{table}_new", 1)
+                await db.execute(f"{create_sql} WITHOUT ROWID")
+                await db.execute(f"INSERT INTO {table}_new SELECT * FROM {table}")
+                await db.execute(f"DROP TABLE {table}")
+                await db.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+                logger.info(f"Rebuilt {table} as a WITHOUT ROWID table")
             except Exception as e:
-                logger.error(f"Error adding undo_until column to personal_expenses: {e}")
-                
-            # Add payment_method column to group_expense_participants if not exists
+                await db.execute(f"DROP TABLE IF EXISTS {table}_new")
+                logger.error(f"Error rebuilding {table} without rowid: {e}")
+                ok = False
+
+        return ok
+
+    async def _optimize_periodically(self):
+        """Run PRAGMA optimize on the writer at a fixed interval."""
+        while True:
+            await asyncio.sleep(OPTIMIZE_INTERVAL_SECONDS)
             try:
-                cursor = await db.execute("PRAGMA table_info(group_expense_participants)")
-                columns = await cursor.fetchall()
-                column_names = [col[1] for col in columns]
-                
-                if 'payment_method' not in column_names:
-                    await db.execute("ALTER TABLE group_expense_participants ADD COLUMN payment_method TEXT DEFAULT 'end_of_day'")
-                    await db.commit()
-                    logger.info("Added payment_method column to group_expense_participants table")
+                async with self._connection(write=True) as db:
+                    await db.execute("PRAGMA optimize")
             except Exception as e:
-                logger.error(f"Error adding payment_method column: {e}")
-                
-            logger.info("Database initialized successfully")
+                logger.error(f"Error running PRAGMA optimize: {e}")
 
     # User operations
     async def create_or_update_user(self, tg_user_id: int, name: str) -> User:
         """Create or update a user and return the user object."""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Check if user exists
+        async with self._connection(write=True) as db:
             cursor = await db.execute(
-                "SELECT id, tg_user_id, name, created_at, last_seen FROM users WHERE tg_user_id = ?",
-                (tg_user_id,)
+                """INSERT INTO users (tg_user_id, name) VALUES (?, ?)
+                   ON CONFLICT(tg_user_id) DO UPDATE SET name = excluded.name, last_seen = CURRENT_TIMESTAMP
+                   RETURNING id, tg_user_id, name, created_at, last_seen""",
+                (tg_user_id, name)
             )
             row = await cursor.fetchone()
-            
-            if row:
-                # Update existing user
-                await db.execute(
-                    "UPDATE users SET name = ?, last_seen = CURRENT_TIMESTAMP WHERE tg_user_id = ?",
-                    (name, tg_user_id)
-                )
-                await db.commit()
-                return User(row[0], row[1], name, row[3], datetime.now())
-            else:
-                # Create new user
-                cursor = await db.execute(
-                    "INSERT INTO users (tg_user_id, name) VALUES (?, ?)",
-                    (tg_user_id, name)
-                )
-                user_id = cursor.lastrowid
-                
-                # Create default settings
-                await db.execute(
-                    "INSERT INTO user_settings (user_id) VALUES (?)",
-                    (user_id,)
-                )
-                await db.commit()
-                
-                return User(user_id, tg_user_id, name, datetime.now(), datetime.now())
+            await cursor.close()
+
+            # Create default settings for new users
+            await db.execute(
+                "INSERT OR IGNORE INTO user_settings (user_id) VALUES (?)",
+                (row[0],)
+            )
+            await db.commit()
+        self._users_by_tg_id.pop(tg_user_id)
+        return User(*row)
 
     async def get_user_by_tg_id(self, tg_user_id: int) -> Optional[User]:
         """Get user by Telegram user ID."""
-        async with aiosqlite.connect(self.db_path) as db:
+        user = self._users_by_tg_id.get(tg_user_id)
+        if user is not None:
+            return user
+        async with self._connection() as db:
             cursor = await db.execute(
                 "SELECT id, tg_user_id, name, created_at, last_seen FROM users WHERE tg_user_id = ?",
                 (tg_user_id,)
             )
             row = await cursor.fetchone()
             if row:
-                return User(*row)
+                user = User(*row)
+                self._users_by_tg_id.set(tg_user_id, user)
+                return user
             return None
 
     # User settings operations
     async def get_user_settings(self, user_id: int) -> UserSettings:
         """Get user settings."""
-        async with aiosqlite.connect(self.db_path) as db:
+        settings = self._user_settings.get(user_id)
+        if settings is not None:
+            return settings
+        async with self._connection() as db:
             cursor = await db.execute(
                 "SELECT user_id, preferred_currency, allow_negative, auto_rule FROM user_settings WHERE user_id = ?",
                 (user_id,)
             )
             row = await cursor.fetchone()
             if row:
-                return UserSettings(*row)
+                settings = UserSettings(*row)
+                self._user_settings.set(user_id, settings)
+                return settings
             return UserSettings(user_id, "TWD", False, False)
 
     async def update_user_settings(self, user_id: int, **kwargs) -> None:
         """Update user settings."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             # First ensure the record exists
             await db.execute(
                 "INSERT OR IGNORE INTO user_settings (user_id, preferred_currency, allow_negative, auto_rule) VALUES (?, 'TWD', TRUE, TRUE)",
@@ -414,91 +700,91 @@ class Database:
                     (kwargs['preferred_currency'], user_id)
                 )
             await db.commit()
+        self._user_settings.pop(user_id)
 
     # Wallet operations
     async def create_wallet(self, user_id: int, currency: str, initial_amount: Decimal, note: Optional[str] = None) -> UserWallet:
         """Create a new wallet."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             cursor = await db.execute(
-                "INSERT INTO user_wallets (user_id, currency, initial_amount, current_balance, note) VALUES (?, ?, ?, ?, ?)",
-                (user_id, currency, str(initial_amount), str(initial_amount), note)
+                """INSERT INTO user_wallets (user_id, currency, initial_amount, current_balance, note) VALUES (?, ?, ?, 0, ?)
+                   RETURNING id, created_at AS "created_at [datetime]", updated_at AS "updated_at [datetime]"
+                """,
+                (user_id, currency, initial_amount, note)
             )
-            wallet_id = cursor.lastrowid
+            wallet_id, created_at, updated_at = await cursor.fetchone()
+            await cursor.close()
             
-            # Log the initial adjustment
+            # Log the initial adjustment; trg_wa_apply credits it to the new wallet
             await db.execute(
                 "INSERT INTO wallet_adjustments (wallet_id, delta_amount, reason) VALUES (?, ?, ?)",
-                (wallet_id, str(initial_amount), "Tạo ví mới")
+                (wallet_id, initial_amount, "Tạo ví mới")
             )
             await db.commit()
             
-            return UserWallet(wallet_id, user_id, currency, initial_amount, initial_amount, note, datetime.now(), datetime.now())
+            return UserWallet(wallet_id, user_id, currency, initial_amount, initial_amount, note, created_at, updated_at)
 
     async def get_user_wallets(self, user_id: int) -> List[UserWallet]:
         """Get all wallets for a user."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
-                "SELECT id, user_id, currency, initial_amount, current_balance, note, created_at, updated_at FROM user_wallets WHERE user_id = ? ORDER BY currency",
+                """SELECT id, user_id, currency, initial_amount AS "initial_amount [decimal]",
+                          current_balance AS "current_balance [decimal]", note, created_at, updated_at
+                   FROM user_wallets WHERE user_id = ? ORDER BY currency""",
                 (user_id,)
             )
             rows = await cursor.fetchall()
-            return [UserWallet(row[0], row[1], row[2], Decimal(str(row[3])), Decimal(str(row[4])), row[5], row[6], row[7]) for row in rows]
+            return [UserWallet(*row) for row in rows]
 
     async def get_wallet(self, wallet_id: int) -> Optional[UserWallet]:
         """Get a wallet by ID."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
-                "SELECT id, user_id, currency, initial_amount, current_balance, note, created_at, updated_at FROM user_wallets WHERE id = ?",
+                """SELECT id, user_id, currency, initial_amount AS "initial_amount [decimal]",
+                          current_balance AS "current_balance [decimal]", note, created_at, updated_at
+                   FROM user_wallets WHERE id = ?""",
                 (wallet_id,)
             )
             row = await cursor.fetchone()
             if row:
-                return UserWallet(row[0], row[1], row[2], Decimal(str(row[3])), Decimal(str(row[4])), row[5], row[6], row[7])
+                return UserWallet(*row)
             return None
 
     async def get_wallet_by_currency(self, user_id: int, currency: str) -> Optional[UserWallet]:
         """Get a wallet by user ID and currency."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
-                "SELECT id, user_id, currency, initial_amount, current_balance, note, created_at, updated_at FROM user_wallets WHERE user_id = ? AND currency = ?",
+                """SELECT id, user_id, currency, initial_amount AS "initial_amount [decimal]",
+                          current_balance AS "current_balance [decimal]", note, created_at, updated_at
+                   FROM user_wallets WHERE user_id = ? AND currency = ?""",
                 (user_id, currency)
             )
             row = await cursor.fetchone()
             if row:
-                return UserWallet(row[0], row[1], row[2], Decimal(str(row[3])), Decimal(str(row[4])), row[5], row[6], row[7])
+                return UserWallet(*row)
             return None
 
     async def update_wallet_balance(self, wallet_id: int, delta_amount: Decimal, reason: str) -> bool:
         """Update wallet balance and log the adjustment."""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Get current balance
-            cursor = await db.execute(
-                "SELECT current_balance FROM user_wallets WHERE id = ?",
-                (wallet_id,)
-            )
-            row = await cursor.fetchone()
-            if not row:
+        async with self._connection(write=True) as db:
+            if not await self._apply_wallet_delta(db, wallet_id, delta_amount, reason):
                 return False
-            
-            new_balance = Decimal(str(row[0])) + delta_amount
-            
-            # Update balance
-            await db.execute(
-                "UPDATE user_wallets SET current_balance = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (str(new_balance), wallet_id)
-            )
-            
-            # Log adjustment
-            await db.execute(
-                "INSERT INTO wallet_adjustments (wallet_id, delta_amount, reason) VALUES (?, ?, ?)",
-                (wallet_id, str(delta_amount), reason)
-            )
             await db.commit()
             return True
 
+    async def _apply_wallet_delta(self, db, wallet_id: int, delta_amount: Decimal, reason: str) -> bool:
+        """Adjust a wallet balance and log it on `db`, without committing."""
+        # trg_wa_apply applies the delta to user_wallets; skip the insert if the wallet is gone
+        cursor = await db.execute(
+            """INSERT INTO wallet_adjustments (wallet_id, delta_amount, reason)
+               SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM user_wallets WHERE id = ?)""",
+            (wallet_id, delta_amount, reason, wallet_id)
+        )
+        return cursor.rowcount > 0
+
     async def delete_wallet(self, wallet_id: int) -> bool:
         """Delete a wallet regardless of balance."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             # Check if wallet exists
             cursor = await db.execute(
                 "SELECT current_balance FROM user_wallets WHERE id = ?",
@@ -519,148 +805,125 @@ class Database:
                                  fx_rate: Optional[Decimal] = None, 
                                  converted_amount: Optional[Decimal] = None) -> PersonalExpense:
         """Add a personal expense."""
-        undo_until = datetime.now() + timedelta(hours=24)
+        async with self._connection(write=True) as db:
+            expense = await self._insert_personal_expense(db, user_id, amount, currency, wallet_id,
+                                                          note, fx_rate, converted_amount)
+            await db.commit()
+            return expense
+
+    async def add_personal_expense_and_debit(self, user_id: int, amount: Decimal, currency: str,
+                                           wallet_id: int, note: Optional[str] = None,
+                                           reason: str = "Chi tiêu cá nhân",
+                                           fx_rate: Optional[Decimal] = None,
+                                           converted_amount: Optional[Decimal] = None) -> Optional[PersonalExpense]:
+        """Add a personal expense and debit its wallet in one transaction.
+
+        Returns None, writing nothing, if the wallet doesn't exist.
+        """
+        debit_amount = converted_amount if converted_amount else amount
         
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                """INSERT INTO personal_expenses 
-                   (user_id, amount, currency, note, wallet_id, fx_rate, converted_amount, undo_until) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                (user_id, str(amount), currency, note, wallet_id, 
-                 str(fx_rate) if fx_rate else None, 
-                 str(converted_amount) if converted_amount else None, undo_until)
-            )
-            expense_id = cursor.lastrowid
+        async with self._connection(write=True) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            if not await self._apply_wallet_delta(db, wallet_id, -debit_amount, reason):
+                await db.rollback()
+                return None
+            expense = await self._insert_personal_expense(db, user_id, amount, currency, wallet_id,
+                                                          note, fx_rate, converted_amount)
             await db.commit()
-            
-            return PersonalExpense(expense_id, user_id, amount, currency, note, 
-                                 wallet_id, fx_rate, converted_amount, datetime.now(), undo_until)
+            return expense
+
+    async def _insert_personal_expense(self, db, user_id: int, amount: Decimal, currency: str,
+                                       wallet_id: int, note: Optional[str],
+                                       fx_rate: Optional[Decimal],
+                                       converted_amount: Optional[Decimal]) -> PersonalExpense:
+        """Insert a personal expense row on `db`, without committing."""
+        undo_until = datetime.now() + timedelta(hours=24)
+        
+        cursor = await db.execute(
+            """INSERT INTO personal_expenses 
+               (user_id, amount, currency, note, wallet_id, fx_rate, converted_amount, undo_until) 
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               RETURNING id, created_at AS "created_at [datetime]"
+            """,
+            (user_id, amount, currency, note, wallet_id, 
+             fx_rate or None, converted_amount or None, undo_until)
+        )
+        expense_id, created_at = await cursor.fetchone()
+        await cursor.close()
+        
+        return PersonalExpense(expense_id, user_id, amount, currency, note, 
+                             wallet_id, fx_rate, converted_amount, created_at, undo_until)
 
     async def get_personal_expenses(self, user_id: int, days: int = 7) -> List[PersonalExpense]:
         """Get personal expenses for the last N days."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
-                """SELECT id, user_id, amount, currency, note, wallet_id, fx_rate, converted_amount, created_at, undo_until 
+                """SELECT id, user_id, amount AS "amount [decimal]", currency, note, wallet_id,
+                          fx_rate AS "fx_rate [decimal]", converted_amount AS "converted_amount [decimal]",
+                          created_at AS "created_at [datetime]", undo_until AS "undo_until [datetime]"
                    FROM personal_expenses 
-                   WHERE user_id = ? AND created_at > datetime('now', '-{} days')
-                   ORDER BY created_at DESC""".format(days),
-                (user_id,)
+                   WHERE user_id = ? AND created_at > datetime('now', ?)
+                   ORDER BY created_at DESC""",
+                (user_id, f"-{int(days)} days")
             )
             rows = await cursor.fetchall()
-            result = []
-            for row in rows:
-                # Convert datetime fields properly
-                created_at = None
-                undo_until = None
-                
-                if row[8]:  # created_at
-                    try:
-                        created_at = datetime.fromisoformat(row[8]) if isinstance(row[8], str) else row[8]
-                    except (ValueError, TypeError):
-                        created_at = None
-                
-                if row[9]:  # undo_until
-                    try:
-                        undo_until = datetime.fromisoformat(row[9]) if isinstance(row[9], str) else row[9]
-                    except (ValueError, TypeError):
-                        undo_until = None
-                
-                result.append(PersonalExpense(
-                    row[0], row[1], Decimal(str(row[2])), row[3], row[4], row[5],
-                    Decimal(str(row[6])) if row[6] else None,
-                    Decimal(str(row[7])) if row[7] else None,
-                    created_at, undo_until
-                ))
-            return result
+            # Money and timestamp columns arrive converted via their "[decimal]"/"[datetime]" aliases
+            return [PersonalExpense(*row) for row in rows]
 
     async def get_personal_expenses_today(self, user_id: int, currency: str = None) -> List[PersonalExpense]:
         """Get personal expenses for today."""
-        async with aiosqlite.connect(self.db_path) as db:
-            if currency:
-                cursor = await db.execute(
-                    """SELECT id, user_id, amount, currency, note, wallet_id, fx_rate, converted_amount, created_at, undo_until 
-                       FROM personal_expenses 
-                       WHERE user_id = ? AND currency = ? AND date(created_at) = date('now')
-                       ORDER BY created_at DESC""",
-                    (user_id, currency)
-                )
-            else:
-                cursor = await db.execute(
-                    """SELECT id, user_id, amount, currency, note, wallet_id, fx_rate, converted_amount, created_at, undo_until 
-                       FROM personal_expenses 
-                       WHERE user_id = ? AND date(created_at) = date('now')
-                       ORDER BY created_at DESC""",
-                    (user_id,)
-                )
+        async with self._connection() as db:
+            cursor = await db.execute(
+                """SELECT id, user_id, amount AS "amount [decimal]", currency, note, wallet_id,
+                          fx_rate AS "fx_rate [decimal]", converted_amount AS "converted_amount [decimal]",
+                          created_at AS "created_at [datetime]", undo_until AS "undo_until [datetime]"
+                   FROM personal_expenses 
+                   WHERE user_id = ? AND (? IS NULL OR currency = ?)
+                     AND created_at >= date('now') AND created_at < date('now', '+1 day')
+                   ORDER BY created_at DESC""",
+                (user_id, currency or None, currency or None)
+            )
             rows = await cursor.fetchall()
-            result = []
-            for row in rows:
-                # Convert datetime fields properly
-                created_at = None
-                undo_until = None
-                
-                if row[8]:  # created_at
-                    try:
-                        created_at = datetime.fromisoformat(row[8]) if isinstance(row[8], str) else row[8]
-                    except (ValueError, TypeError):
-                        created_at = None
-                
-                if row[9]:  # undo_until
-                    try:
-                        undo_until = datetime.fromisoformat(row[9]) if isinstance(row[9], str) else row[9]
-                    except (ValueError, TypeError):
-                        undo_until = None
-                
-                result.append(PersonalExpense(
-                    row[0], row[1], Decimal(str(row[2])), row[3], row[4], row[5],
-                    Decimal(str(row[6])) if row[6] else None,
-                    Decimal(str(row[7])) if row[7] else None,
-                    created_at, undo_until
-                ))
-            return result
+            # Money and timestamp columns arrive converted via their "[decimal]"/"[datetime]" aliases
+            return [PersonalExpense(*row) for row in rows]
 
     async def undo_personal_expense(self, expense_id: int, user_id: int) -> bool:
         """Undo a personal expense if within time limit."""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Check if expense exists and can be undone
+        async with self._connection(write=True) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            # Delete the expense and read back what it cost; rolled back below if it can't be undone
             cursor = await db.execute(
-                """SELECT amount, currency, wallet_id, converted_amount, undo_until 
-                   FROM personal_expenses 
-                   WHERE id = ? AND user_id = ?""",
+                """DELETE FROM personal_expenses 
+                   WHERE id = ? AND user_id = ?
+                   RETURNING amount AS "amount [decimal]", wallet_id, converted_amount AS "converted_amount [decimal]",
+                             undo_until AS "undo_until [datetime]"
+                """,
                 (expense_id, user_id)
             )
             row = await cursor.fetchone()
+            await cursor.close()
             if not row:
+                await db.rollback()
                 return False
             
-            amount, currency, wallet_id, converted_amount, undo_until = row
-            
-            # Check if expense can still be undone (within time limit)
-            current_time = datetime.now()
-            undo_until_dt = None
-            
-            if undo_until:
-                try:
-                    undo_until_dt = datetime.fromisoformat(undo_until) if isinstance(undo_until, str) else undo_until
-                except (ValueError, TypeError):
-                    undo_until_dt = None
+            amount, wallet_id, converted_amount, undo_until = row
             
-            if not undo_until_dt or undo_until_dt <= current_time:
+            # Check if expense can still be undone (within time limit).
+            # undo_until is local time, so this can't be compared against CURRENT_TIMESTAMP in SQL
+            if not undo_until or undo_until <= datetime.now():
+                await db.rollback()
                 return False  # Expense has expired
             
-            restore_amount = Decimal(str(converted_amount)) if converted_amount else Decimal(str(amount))
+            restore_amount = converted_amount if converted_amount else amount
             
-            # Restore wallet balance
-            await self.update_wallet_balance(wallet_id, Decimal(str(restore_amount)), "Hoàn tác chi tiêu")
-            
-            # Delete expense record
-            await db.execute("DELETE FROM personal_expenses WHERE id = ?", (expense_id,))
+            # Restore wallet balance in the same transaction as the delete
+            await self._apply_wallet_delta(db, wallet_id, restore_amount, "Hoàn tác chi tiêu")
             await db.commit()
             return True
 
     async def delete_personal_expense(self, expense_id: int, user_id: int) -> bool:
         """Hard delete a personal expense regardless of time, without balance restoration."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             cursor = await db.execute(
                 "DELETE FROM personal_expenses WHERE id = ? AND user_id = ?",
                 (expense_id, user_id)
@@ -668,98 +931,66 @@ class Database:
             await db.commit()
             return cursor.rowcount > 0
 
-    async def get_group_expenses_by_user(self, user_id: int, group_id: int, days: int) -> List:
+    async def get_group_expenses_by_user(self, user_id: int, group_id: int, days: int) -> List[GroupExpenseRow]:
         """Get group expenses by user for specified days."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 """SELECT id, amount, currency, description, payer_user_id, 
                           datetime(created_at, '+7 hours') as local_time, 
-                          undo_until
+                          undo_until AS "undo_until [datetime]"
                    FROM group_expenses 
                    WHERE payer_user_id = ? AND group_id = ? 
-                   AND date(created_at) >= date('now', '-{} days')
-                   ORDER BY created_at DESC""".format(days),
-                (user_id, group_id)
+                   AND created_at >= date('now', ?)
+                   ORDER BY created_at DESC""",
+                (user_id, group_id, f"-{int(days)} days")
             )
-            rows = await cursor.fetchall()
-            
-            # Create simple expense objects with required attributes
-            result = []
-            for row in rows:
-                expense = type('Expense', (), {})()
-                expense.id = row[0]
-                expense.amount = row[1] 
-                expense.currency = row[2]
-                expense.description = row[3]
-                expense.payer_id = row[4]
-                expense.created_at = row[5]
-                
-                # Convert undo_until datetime properly
-                undo_until = None
-                if row[6]:  # undo_until
-                    try:
-                        undo_until = datetime.fromisoformat(row[6]) if isinstance(row[6], str) else row[6]
-                    except (ValueError, TypeError):
-                        undo_until = None
-                
-                expense.undo_until = undo_until
-                result.append(expense)
-            return result
+            return [GroupExpenseRow(*row) async for row in cursor]
 
     async def undo_group_expense(self, expense_id: int, user_id: int) -> bool:
         """Undo a group expense if within time limit and user is the payer."""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Check if expense exists and can be undone
+        async with self._connection(write=True) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            # Delete the expense if this user paid it; rolled back below if it can't be undone
             cursor = await db.execute(
-                """SELECT payer_id, group_id, undo_until 
-                   FROM group_expenses 
-                   WHERE id = ? AND payer_id = ?""",
+                """DELETE FROM group_expenses 
+                   WHERE id = ? AND payer_user_id = ?
+                   RETURNING undo_until AS "undo_until [datetime]"
+                """,
                 (expense_id, user_id)
             )
             row = await cursor.fetchone()
+            await cursor.close()
             if not row:
+                await db.rollback()
                 return False
             
-            payer_id, group_id, undo_until = row
-            
             # Check if expense can still be undone (within time limit)
-            current_time = datetime.now()
-            undo_until_dt = None
-            
-            if undo_until:
-                try:
-                    undo_until_dt = datetime.fromisoformat(undo_until) if isinstance(undo_until, str) else undo_until
-                except (ValueError, TypeError):
-                    undo_until_dt = None
-            
-            if not undo_until_dt or undo_until_dt <= current_time:
+            undo_until = row[0]
+            if not undo_until or undo_until <= datetime.now():
+                await db.rollback()
                 return False  # Expense has expired
             
-            # Delete related debts
-            await db.execute("DELETE FROM debts WHERE expense_id = ?", (expense_id,))
-            
-            # Delete expense record
-            await db.execute("DELETE FROM group_expenses WHERE id = ?", (expense_id,))
+            # trg_ge_delete_participants already removed the participants' shares
             await db.commit()
-            return True
+        self._expenses_by_id.pop(expense_id)
+        return True
 
     async def delete_group_expense(self, expense_id: int, user_id: int) -> bool:
         """Hard delete a group expense regardless of time, ensuring related debts are removed."""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Remove related debts first
-            await db.execute("DELETE FROM debts WHERE expense_id = ?", (expense_id,))
-            # Remove the expense (only if issued by this user)
+        async with self._connection(write=True) as db:
+            # Remove the expense (only if issued by this user); trg_ge_delete_participants removes its shares
             cursor = await db.execute(
-                "DELETE FROM group_expenses WHERE id = ? AND payer_id = ?",
+                "DELETE FROM group_expenses WHERE id = ? AND payer_user_id = ?",
                 (expense_id, user_id)
             )
             await db.commit()
-            return cursor.rowcount > 0
+        self._expenses_by_id.pop(expense_id)
+        return cursor.rowcount > 0
 
     # Trip operations
     async def create_trip(self, code: str, name: str, base_currency: str, owner_user_id: int) -> Trip:
         """Create a new trip."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             cursor = await db.execute(
                 "INSERT INTO trips (code, name, base_currency, owner_user_id) VALUES (?, ?, ?, ?)",
                 (code, name, base_currency, owner_user_id)
@@ -777,7 +1008,7 @@ class Database:
 
     async def get_trip_by_code(self, code: str) -> Optional[Trip]:
         """Get trip by code."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 "SELECT id, code, name, base_currency, owner_user_id, created_at FROM trips WHERE code = ?",
                 (code,)
@@ -789,7 +1020,7 @@ class Database:
 
     async def join_trip(self, trip_id: int, user_id: int) -> bool:
         """Join a user to a trip."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             try:
                 await db.execute(
                     "INSERT INTO trip_members (trip_id, user_id, role) VALUES (?, ?, ?)",
@@ -797,12 +1028,13 @@ class Database:
                 )
                 await db.commit()
                 return True
-            except:
+            except sqlite3.IntegrityError:
+                await db.rollback()
                 return False  # User already in trip
 
     async def get_trip_members(self, trip_id: int) -> List[Tuple[User, str]]:
         """Get all members of a trip with their roles."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 """SELECT u.id, u.tg_user_id, u.name, u.created_at, u.last_seen, tm.role
                    FROM users u 
@@ -816,19 +1048,26 @@ class Database:
     # Exchange rate operations
     async def save_exchange_rate(self, from_currency: str, to_currency: str, rate: Decimal, set_by: str = None) -> None:
         """Save exchange rate to cache."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             await db.execute(
                 "INSERT OR REPLACE INTO exchange_rates (from_currency, to_currency, rate, set_by) VALUES (?, ?, ?, ?)",
-                (from_currency, to_currency, str(rate), set_by)
+                (from_currency, to_currency, rate, set_by)
             )
             await db.commit()
+        self._forget_exchange_rate(from_currency, to_currency)
+
+    def _forget_exchange_rate(self, from_currency: str, to_currency: str) -> None:
+        """Drop cached lookups for a currency pair in both directions."""
+        for key in ((from_currency, to_currency), (to_currency, from_currency)):
+            self._exchange_rates.pop(key)
+            self._latest_exchange_rates.pop(key)
 
     # Group expense operations
     async def add_group_expense(self, trip_id: int, payer_user_id: int, amount: Decimal, 
                               currency: str, rate_to_base: Decimal, amount_base: Decimal, 
                               note: Optional[str] = None) -> int:
         """Add a group expense and return expense ID."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             cursor = await db.execute(
                 """INSERT INTO expenses (trip_id, payer_user_id, amount, currency, rate_to_base, amount_base, note)
                    VALUES (?, ?, ?, ?, ?, ?, ?)""",
@@ -840,44 +1079,43 @@ class Database:
 
     async def add_expense_shares(self, expense_id: int, shares: List[Tuple[int, Decimal]]) -> None:
         """Add expense shares for participants."""
-        async with aiosqlite.connect(self.db_path) as db:
-            for user_id, share_ratio in shares:
-                await db.execute(
-                    "INSERT INTO expense_shares (expense_id, user_id, share_ratio) VALUES (?, ?, ?)",
-                    (expense_id, user_id, share_ratio)
-                )
+        async with self._connection(write=True) as db:
+            await db.executemany(
+                "INSERT INTO expense_shares (expense_id, user_id, share_ratio) VALUES (?, ?, ?)",
+                [(expense_id, user_id, share_ratio) for user_id, share_ratio in shares]
+            )
             await db.commit()
 
     async def get_trip_balances(self, trip_id: int) -> List[Tuple[User, Decimal]]:
         """Calculate net balances for all trip members."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
-                """SELECT u.id, u.tg_user_id, u.name, u.created_at, u.last_seen,
-                          COALESCE(paid.total, 0) - COALESCE(owed.total, 0) as net_balance
+                """WITH tx AS (
+                       SELECT id, payer_user_id, amount_base FROM expenses WHERE trip_id = ?
+                   ),
+                   paid AS (
+                       SELECT payer_user_id AS user_id, SUM(amount_base) AS total
+                       FROM tx GROUP BY payer_user_id
+                   ),
+                   owed AS (
+                       SELECT es.user_id, SUM(tx.amount_base * es.share_ratio) AS total
+                       FROM tx JOIN expense_shares es ON tx.id = es.expense_id
+                       GROUP BY es.user_id
+                   )
+                   SELECT u.id, u.tg_user_id, u.name, u.created_at, u.last_seen,
+                          COALESCE(paid.total, 0) - COALESCE(owed.total, 0) AS "net_balance [decimal]"
                    FROM users u
                    JOIN trip_members tm ON u.id = tm.user_id
-                   LEFT JOIN (
-                       SELECT payer_user_id, SUM(amount_base) as total
-                       FROM expenses 
-                       WHERE trip_id = ?
-                       GROUP BY payer_user_id
-                   ) paid ON u.id = paid.payer_user_id
-                   LEFT JOIN (
-                       SELECT es.user_id, SUM(e.amount_base * es.share_ratio) as total
-                       FROM expenses e
-                       JOIN expense_shares es ON e.id = es.expense_id
-                       WHERE e.trip_id = ?
-                       GROUP BY es.user_id
-                   ) owed ON u.id = owed.user_id
+                   LEFT JOIN paid ON u.id = paid.user_id
+                   LEFT JOIN owed ON u.id = owed.user_id
                    WHERE tm.trip_id = ?""",
-                (trip_id, trip_id, trip_id)
+                (trip_id, trip_id)
             )
-            rows = await cursor.fetchall()
-            return [(User(row[0], row[1], row[2], row[3], row[4]), Decimal(str(row[5]))) for row in rows]
+            return [(User(row[0], row[1], row[2], row[3], row[4]), row[5]) async for row in cursor]
 
     async def get_recent_trip_expenses(self, trip_id: int, limit: int = 5) -> List[Tuple[Expense, User]]:
         """Get recent expenses for a trip."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 """SELECT e.id, e.trip_id, e.payer_user_id, e.amount, e.currency, 
                           e.rate_to_base, e.amount_base, e.note, e.created_at,
@@ -896,7 +1134,7 @@ class Database:
                                 share_amount: Decimal, share_currency: str, wallet_id: int,
                                 fx_rate_used: Decimal, deducted_amount: Decimal) -> None:
         """Record a group deduction."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             await db.execute(
                 """INSERT INTO group_deductions 
                    (user_id, trip_id, expense_id, share_amount, share_currency, wallet_id, fx_rate_used, deducted_amount_in_wallet_currency)
@@ -910,7 +1148,7 @@ class Database:
                                   suggested_wallet_id: int = None, suggested_fx_rate: Decimal = None,
                                   suggested_deduction_amount: Decimal = None) -> None:
         """Record a pending deduction (before user confirms payment)."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             await db.execute(
                 """INSERT INTO pending_deductions 
                    (user_id, trip_id, expense_id, share_amount, share_currency, 
@@ -923,7 +1161,7 @@ class Database:
 
     async def get_user_pending_deductions(self, user_id: int) -> List[Dict]:
         """Get all pending deductions for a user."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 """SELECT pd.*, e.note as description, e.amount as expense_amount, e.currency as expense_currency,
                           uw.currency as wallet_currency, uw.current_balance as wallet_balance
@@ -939,13 +1177,15 @@ class Database:
 
     async def confirm_pending_deduction(self, pending_id: int, wallet_id: int) -> bool:
         """Confirm a pending deduction and move it to group_deductions."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
+            await db.execute("BEGIN IMMEDIATE")
             # Get pending deduction details
             cursor = await db.execute(
                 "SELECT * FROM pending_deductions WHERE id = ?", (pending_id,)
             )
             pending = await cursor.fetchone()
             if not pending:
+                await db.rollback()
                 return False
             
             # Move to group_deductions (using suggested values for now)
@@ -965,7 +1205,7 @@ class Database:
 
     async def cancel_pending_deduction(self, pending_id: int) -> bool:
         """Cancel a pending deduction."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             await db.execute("DELETE FROM pending_deductions WHERE id = ?", (pending_id,))
             await db.commit()
             return True
@@ -974,53 +1214,72 @@ class Database:
     async def create_group_expense(self, group_id: int, payer_user_id: int, amount: Decimal, 
                                  currency: str, description: str = None) -> int:
         """Create a new group expense and return its ID."""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                """INSERT INTO group_expenses (group_id, payer_user_id, amount, currency, description)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (group_id, payer_user_id, amount, currency, description)
-            )
+        async with self._connection(write=True) as db:
+            expense_id = await self._insert_group_expense(db, group_id, payer_user_id, amount, currency, description)
             await db.commit()
-            return cursor.lastrowid
+            return expense_id
+
+    async def create_group_expense_with_participants(self, group_id: int, payer_user_id: int, amount: Decimal,
+                                                     currency: str, description: Optional[str],
+                                                     participants: List[Tuple[int, Decimal]]) -> int:
+        """Create a group expense and its participants in one transaction and return its ID."""
+        async with self._connection(write=True) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            expense_id = await self._insert_group_expense(db, group_id, payer_user_id, amount, currency, description)
+            await self._insert_expense_participants(db, expense_id, participants)
+            await db.commit()
+            return expense_id
+
+    async def _insert_group_expense(self, db, group_id: int, payer_user_id: int, amount: Decimal,
+                                    currency: str, description: Optional[str]) -> int:
+        """Insert a group expense row on `db`, without committing."""
+        cursor = await db.execute(
+            """INSERT INTO group_expenses (group_id, payer_user_id, amount, currency, description)
+               VALUES (?, ?, ?, ?, ?)""",
+            (group_id, payer_user_id, amount, currency, description)
+        )
+        return cursor.lastrowid
 
     async def add_expense_participants(self, expense_id: int, participants: List[Tuple[int, Decimal]]) -> None:
         """Add participants to a group expense."""
-        async with aiosqlite.connect(self.db_path) as db:
-            for user_id, share_amount in participants:
-                await db.execute(
-                    """INSERT INTO group_expense_participants (expense_id, user_id, share_amount)
-                       VALUES (?, ?, ?)""",
-                    (expense_id, user_id, share_amount)
-                )
+        async with self._connection(write=True) as db:
+            await self._insert_expense_participants(db, expense_id, participants)
             await db.commit()
 
+    async def _insert_expense_participants(self, db, expense_id: int,
+                                           participants: List[Tuple[int, Decimal]]) -> None:
+        """Insert group expense participants on `db`, without committing."""
+        await db.executemany(
+            """INSERT INTO group_expense_participants (expense_id, user_id, share_amount)
+               VALUES (?, ?, ?)""",
+            [(expense_id, user_id, share_amount) for user_id, share_amount in participants]
+        )
+
     async def get_group_expense(self, expense_id: int) -> Optional[GroupExpense]:
         """Get a group expense by ID."""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
+        async with self._connection() as db:
+            rows = await db.execute_fetchall(
                 """SELECT id, group_id, payer_user_id, amount, currency, description, created_at, settled
                    FROM group_expenses WHERE id = ?""",
                 (expense_id,)
             )
-            row = await cursor.fetchone()
-            if row:
-                return GroupExpense(*row)
+            if rows:
+                return GroupExpense(*rows[0])
             return None
 
     async def get_expense_participants(self, expense_id: int) -> List[GroupExpenseParticipant]:
         """Get all participants of a group expense."""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
+        async with self._connection() as db:
+            rows = await db.execute_fetchall(
                 """SELECT id, expense_id, user_id, share_amount, paid, reminded
                    FROM group_expense_participants WHERE expense_id = ?""",
                 (expense_id,)
             )
-            rows = await cursor.fetchall()
             return [GroupExpenseParticipant(*row) for row in rows]
 
     async def mark_participant_paid(self, expense_id: int, user_id: int) -> None:
         """Mark a participant as having paid their share."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             await db.execute(
                 """UPDATE group_expense_participants SET paid = TRUE 
                    WHERE expense_id = ? AND user_id = ?""",
@@ -1030,7 +1289,7 @@ class Database:
 
     async def get_unpaid_participants(self, group_id: int) -> List[Tuple[GroupExpense, GroupExpenseParticipant, User]]:
         """Get all unpaid participants in a group."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 """SELECT ge.id, ge.group_id, ge.payer_user_id, ge.amount, ge.currency, 
                           ge.description, ge.created_at, ge.settled,
@@ -1043,49 +1302,35 @@ class Database:
                    ORDER BY ge.created_at DESC""",
                 (group_id,)
             )
-            rows = await cursor.fetchall()
-            return [(GroupExpense(*row[:8]), GroupExpenseParticipant(*row[8:14]), User(row[14], row[15], row[16], row[17], row[18])) for row in rows]
+            # Only this cursor's rows are affected; the shared connection keeps plain tuples
+            cursor.row_factory = _unpaid_participant_row
+            return [row async for row in cursor]
 
     async def update_group_debts(self, group_id: int, debtor_id: int, creditor_id: int, 
                                amount: Decimal, currency: str) -> None:
         """Update debt between two users in a group."""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Check if debt already exists
-            cursor = await db.execute(
-                """SELECT amount FROM group_debts 
-                   WHERE group_id = ? AND debtor_user_id = ? AND creditor_user_id = ? AND currency = ?""",
+        async with self._connection(write=True) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            # Create the debt or add to it; rounded to the column's DECIMAL(15,2) scale
+            await db.execute(
+                """INSERT INTO group_debts (group_id, debtor_user_id, creditor_user_id, amount, currency)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(group_id, debtor_user_id, creditor_user_id, currency)
+                   DO UPDATE SET amount = ROUND(group_debts.amount + excluded.amount, 2),
+                                 last_updated = CURRENT_TIMESTAMP""",
                 (group_id, debtor_id, creditor_id, amount, currency)
             )
-            existing = await cursor.fetchone()
-            
-            if existing:
-                new_amount = Decimal(str(existing[0])) + amount
-                if new_amount == 0:
-                    # Delete if debt is settled
-                    await db.execute(
-                        """DELETE FROM group_debts 
-                           WHERE group_id = ? AND debtor_user_id = ? AND creditor_user_id = ? AND currency = ?""",
-                        (group_id, debtor_id, creditor_id, currency)
-                    )
-                else:
-                    # Update existing debt
-                    await db.execute(
-                        """UPDATE group_debts SET amount = ?, last_updated = CURRENT_TIMESTAMP
-                           WHERE group_id = ? AND debtor_user_id = ? AND creditor_user_id = ? AND currency = ?""",
-                        (new_amount, group_id, debtor_id, creditor_id, currency)
-                    )
-            else:
-                # Create new debt
-                await db.execute(
-                    """INSERT INTO group_debts (group_id, debtor_user_id, creditor_user_id, amount, currency)
-                       VALUES (?, ?, ?, ?, ?)""",
-                    (group_id, debtor_id, creditor_id, amount, currency)
-                )
+            # Delete if debt is settled
+            await db.execute(
+                """DELETE FROM group_debts 
+                   WHERE group_id = ? AND debtor_user_id = ? AND creditor_user_id = ? AND currency = ? AND amount = 0""",
+                (group_id, debtor_id, creditor_id, currency)
+            )
             await db.commit()
 
     async def get_group_debts(self, group_id: int) -> List[Tuple[GroupDebt, User, User]]:
         """Get all debts in a group with debtor and creditor info."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 """SELECT gd.id, gd.group_id, gd.debtor_user_id, gd.creditor_user_id, 
                           gd.amount, gd.currency, gd.last_updated,
@@ -1098,124 +1343,134 @@ class Database:
                    ORDER BY gd.amount DESC""",
                 (group_id,)
             )
+            return [(GroupDebt(*row[:7]), User(row[7], row[8], row[9], row[10], row[11]), User(row[12], row[13], row[14], row[15], row[16]))
+                    async for row in cursor]
+
+    async def _get_group_net_balances(self, group_id: int, currency: str) -> List[Tuple[User, Decimal]]:
+        """Net balance per user for a group's debts in one currency (positive = owed money)."""
+        async with self._connection() as db:
+            cursor = await db.execute(
+                """SELECT u.id, u.tg_user_id, u.name, u.created_at, u.last_seen, b.net AS "net [decimal]"
+                   FROM (
+                       SELECT user_id, ROUND(SUM(amt), 2) AS net
+                       FROM (
+                           SELECT creditor_user_id AS user_id, amount AS amt
+                           FROM group_debts WHERE group_id = ? AND currency = ? AND amount > 0
+                           UNION ALL
+                           SELECT debtor_user_id, -amount
+                           FROM group_debts WHERE group_id = ? AND currency = ? AND amount > 0
+                       )
+                       GROUP BY user_id
+                       HAVING net <> 0
+                   ) b
+                   JOIN users u ON u.id = b.user_id""",
+                (group_id, currency, group_id, currency)
+            )
             rows = await cursor.fetchall()
-            return [(GroupDebt(*row[:7]), User(row[7], row[8], row[9], row[10], row[11]), User(row[12], row[13], row[14], row[15], row[16])) for row in rows]
+            return [(User(*row[:5]), row[5]) for row in rows]
 
     async def optimize_group_debts(self, group_id: int, currency: str) -> List[Tuple[User, User, Decimal]]:
         """Optimize debts in a group to minimize transactions."""
-        debts = await self.get_group_debts(group_id)
-        
-        # Filter by currency and build balance map
-        balances = {}  # user_id -> net balance (positive = owed money, negative = owes money)
-        
-        for debt, debtor, creditor in debts:
-            if debt.currency != currency:
-                continue
-                
-            if debtor.id not in balances:
-                balances[debtor.id] = Decimal('0')
-            if creditor.id not in balances:
-                balances[creditor.id] = Decimal('0')
-                
-            balances[debtor.id] -= debt.amount  # They owe money
-            balances[creditor.id] += debt.amount  # They are owed money
+        balances = await self._get_group_net_balances(group_id, currency)
         
         # Separate creditors (positive) and debtors (negative)
-        creditors = [(user_id, amount) for user_id, amount in balances.items() if amount > 0]
-        debtors = [(user_id, -amount) for user_id, amount in balances.items() if amount < 0]
+        creditors = [(user, amount) for user, amount in balances if amount > 0]
+        debtors = [(user, -amount) for user, amount in balances if amount < 0]
         
         # Optimize transactions
         transactions = []
         creditors.sort(key=lambda x: x[1], reverse=True)  # Largest creditors first
         debtors.sort(key=lambda x: x[1], reverse=True)    # Largest debtors first
         
-        async with aiosqlite.connect(self.db_path) as db:
-            i = j = 0
-            while i < len(creditors) and j < len(debtors):
-                creditor_id, credit_amount = creditors[i]
-                debtor_id, debt_amount = debtors[j]
-                
-                transfer_amount = min(credit_amount, debt_amount)
-                
-                # Get user objects for the transaction
-                cursor = await db.execute(
-                    "SELECT id, tg_user_id, name, created_at, last_seen FROM users WHERE id IN (?, ?)",
-                    (debtor_id, creditor_id)
-                )
-                user_rows = await cursor.fetchall()
-                user_map = {row[0]: User(*row) for row in user_rows}
-                
-                transactions.append((user_map[debtor_id], user_map[creditor_id], transfer_amount))
-                
-                # Update balances
-                creditors[i] = (creditor_id, credit_amount - transfer_amount)
-                debtors[j] = (debtor_id, debt_amount - transfer_amount)
+        i = j = 0
+        while i < len(creditors) and j < len(debtors):
+            creditor, credit_amount = creditors[i]
+            debtor, debt_amount = debtors[j]
             
-                # Move to next creditor/debtor if current one is settled
-                if creditors[i][1] == 0:
-                    i += 1
-                if debtors[j][1] == 0:
-                    j += 1
+            transfer_amount = min(credit_amount, debt_amount)
+            
+            transactions.append((debtor, creditor, transfer_amount))
+            
+            # Update balances
+            creditors[i] = (creditor, credit_amount - transfer_amount)
+            debtors[j] = (debtor, debt_amount - transfer_amount)
+        
+            # Move to next creditor/debtor if current one is settled
+            if creditors[i][1] == 0:
+                i += 1
+            if debtors[j][1] == 0:
+                j += 1
         
         return transactions
 
     # Exchange Rate Functions
     async def set_exchange_rate(self, from_currency: str, to_currency: str, rate: Decimal, set_by: int):
         """Set exchange rate (admin only)."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             await db.execute("""
                 INSERT OR REPLACE INTO exchange_rates (from_currency, to_currency, rate, set_by)
                 VALUES (?, ?, ?, ?)
-            """, (from_currency, to_currency, str(rate), set_by))
+            """, (from_currency, to_currency, rate, set_by))
             await db.commit()
+        self._forget_exchange_rate(from_currency, to_currency)
 
     async def get_exchange_rate(self, from_currency: str, to_currency: str) -> Optional[Decimal]:
         """Get exchange rate between currencies."""
         if from_currency == to_currency:
-            return Decimal('1')
-            
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("""
-                SELECT rate FROM exchange_rates 
-                WHERE from_currency = ? AND to_currency = ?
-            """, (from_currency, to_currency))
-            result = await cursor.fetchone()
-            
-            if result:
-                return Decimal(str(result[0]))
+            return _DEC_ONE
+        
+        key = (from_currency, to_currency)
+        rate = self._exchange_rates.get(key)
+        if rate is not None:
+            return rate
             
-            # Try reverse rate
-            cursor = await db.execute("""
-                SELECT rate FROM exchange_rates 
-                WHERE from_currency = ? AND to_currency = ?
-            """, (to_currency, from_currency))
-            result = await cursor.fetchone()
+        async with self._connection() as db:
+            # Direct rate if set, otherwise the inverse of the reverse rate
+            rows = await db.execute_fetchall("""
+                SELECT rate AS "rate [decimal]", inverse FROM (
+                    SELECT rate, 0 AS inverse FROM exchange_rates 
+                    WHERE from_currency = ? AND to_currency = ?
+                    UNION ALL
+                    SELECT rate, 1 FROM exchange_rates 
+                    WHERE from_currency = ? AND to_currency = ?
+                )
+                ORDER BY inverse LIMIT 1
+            """, (from_currency, to_currency, to_currency, from_currency))
             
-            if result:
-                return Decimal('1') / Decimal(str(result[0]))
+            if rows:
+                result = rows[0]
+                rate = _DEC_ONE / result[0] if result[1] else result[0]
             
-            return None
+            if rate is not None:
+                self._exchange_rates.set(key, rate)
+            return rate
 
     async def get_latest_exchange_rate(self, from_currency: str, to_currency: str) -> Optional[dict]:
         """Get the latest exchange rate with timestamp."""
-        async with aiosqlite.connect(self.db_path) as db:
+        key = (from_currency, to_currency)
+        latest = self._latest_exchange_rates.get(key)
+        if latest is not None:
+            return dict(latest)
+        async with self._connection() as db:
             cursor = await db.execute("""
-                SELECT rate, created_at FROM exchange_rates 
+                SELECT rate AS "rate [decimal]", created_at FROM exchange_rates 
                 WHERE from_currency = ? AND to_currency = ?
                 ORDER BY created_at DESC LIMIT 1
             """, (from_currency, to_currency))
             result = await cursor.fetchone()
             
             if result:
-                return {
-                    'rate': Decimal(str(result[0])),
+                latest = {
+                    'rate': result[0],
                     'created_at': result[1]
                 }
+                self._latest_exchange_rates.set(key, latest)
+                return dict(latest)
             return None
 
     async def get_all_exchange_rates(self) -> List[Tuple]:
         """Get all exchange rates."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute("""
                 SELECT from_currency, to_currency, rate, created_at 
                 FROM exchange_rates 
@@ -1227,24 +1482,18 @@ class Database:
     async def add_bank_account(self, user_id: int, bank_code: str, bank_name: str, 
                               account_number: str, account_name: str) -> int:
         """Add bank account for user."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             # If this is first account, make it default
-            cursor = await db.execute("""
-                SELECT COUNT(*) FROM bank_accounts WHERE user_id = ?
-            """, (user_id,))
-            count = (await cursor.fetchone())[0]
-            is_default = count == 0
-            
             cursor = await db.execute("""
                 INSERT INTO bank_accounts (user_id, bank_code, bank_name, account_number, account_name, is_default)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (user_id, bank_code, bank_name, account_number, account_name, is_default))
+                VALUES (?, ?, ?, ?, ?, NOT EXISTS (SELECT 1 FROM bank_accounts WHERE user_id = ?))
+            """, (user_id, bank_code, bank_name, account_number, account_name, user_id))
             await db.commit()
             return cursor.lastrowid
 
     async def get_user_bank_accounts(self, user_id: int) -> List[Tuple]:
         """Get all bank accounts for user."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute("""
                 SELECT id, bank_code, bank_name, account_number, account_name, is_default
                 FROM bank_accounts 
@@ -1253,19 +1502,41 @@ class Database:
             """, (user_id,))
             return await cursor.fetchall()
 
+    async def get_payment_settings(self, user_id: int) -> Tuple[bool, List[BankAccountSummary]]:
+        """Get whether the user accepts VND payments, plus their bank accounts, in one query."""
+        async with self._connection() as db:
+            # Always yields one row; account columns are NULL when there are no accounts
+            cursor = await db.execute("""
+                SELECT (SELECT accept_vnd_payments FROM payment_preferences WHERE user_id = ?1),
+                       ba.bank_name, ba.account_number, ba.is_default
+                FROM (SELECT 1)
+                LEFT JOIN bank_accounts ba ON ba.user_id = ?1
+                ORDER BY ba.is_default DESC, ba.created_at ASC
+            """, (user_id,))
+            rows = await cursor.fetchall()
+        accept_vnd = bool(rows[0][0])
+        accounts = [
+            BankAccountSummary(bank_name, account_number, bool(is_default))
+            for _, bank_name, account_number, is_default in rows
+            if bank_name is not None
+        ]
+        return accept_vnd, accounts
+
     async def get_default_bank_account(self, user_id: int) -> Optional[Tuple]:
         """Get default bank account for user."""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("""
+        async with self._connection() as db:
+            # execute_fetchall runs the query and fetch in one hop to the connection's thread
+            rows = await db.execute_fetchall("""
                 SELECT id, bank_code, bank_name, account_number, account_name
                 FROM bank_accounts 
                 WHERE user_id = ? AND is_default = TRUE
+                LIMIT 1
             """, (user_id,))
-            return await cursor.fetchone()
+            return rows[0] if rows else None
 
     async def set_default_bank_account(self, user_id: int, account_id: int):
         """Set default bank account."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             # Remove default from all accounts
             await db.execute("""
                 UPDATE bank_accounts SET is_default = FALSE WHERE user_id = ?
@@ -1280,82 +1551,37 @@ class Database:
     async def update_payment_preferences(self, user_id: int, accept_vnd: bool = None, 
                                         auto_convert: bool = None, preferred_bank_id: int = None):
         """Update user payment preferences."""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Check if preferences exist
-            cursor = await db.execute("""
-                SELECT user_id FROM payment_preferences WHERE user_id = ?
-            """, (user_id,))
-            exists = await cursor.fetchone()
-            
-            if exists:
-                # Update existing
-                updates = []
-                params = []
-                if accept_vnd is not None:
-                    updates.append("accept_vnd_payments = ?")
-                    params.append(accept_vnd)
-                if auto_convert is not None:
-                    updates.append("auto_convert_debts = ?")
-                    params.append(auto_convert)
-                if preferred_bank_id is not None:
-                    updates.append("preferred_bank_id = ?")
-                    params.append(preferred_bank_id)
-                
-                if updates:
-                    params.append(user_id)
-                    await db.execute(f"""
-                        UPDATE payment_preferences SET {', '.join(updates)} WHERE user_id = ?
-                    """, params)
-            else:
-                # Insert new
-                await db.execute("""
-                    INSERT INTO payment_preferences (user_id, accept_vnd_payments, auto_convert_debts, preferred_bank_id)
-                    VALUES (?, ?, ?, ?)
-                """, (user_id, accept_vnd or False, auto_convert or False, preferred_bank_id))
-            
+        async with self._connection(write=True) as db:
+            # One upsert; NULL arguments keep the stored value (or default to FALSE on insert)
+            await db.execute("""
+                INSERT INTO payment_preferences (user_id, accept_vnd_payments, auto_convert_debts, preferred_bank_id)
+                VALUES (?1, COALESCE(?2, FALSE), COALESCE(?3, FALSE), ?4)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    accept_vnd_payments = COALESCE(?2, accept_vnd_payments),
+                    auto_convert_debts = COALESCE(?3, auto_convert_debts),
+                    preferred_bank_id = COALESCE(?4, preferred_bank_id)
+            """, (user_id, accept_vnd, auto_convert, preferred_bank_id))
             await db.commit()
+        self._payment_preferences.pop(user_id)
 
     async def get_payment_preferences(self, user_id: int) -> Optional[Tuple]:
         """Get user payment preferences."""
-        async with aiosqlite.connect(self.db_path) as db:
+        preferences = self._payment_preferences.get(user_id)
+        if preferences is not None:
+            return preferences
+        async with self._connection() as db:
             cursor = await db.execute("""
                 SELECT accept_vnd_payments, auto_convert_debts, preferred_bank_id
                 FROM payment_preferences WHERE user_id = ?
             """, (user_id,))
-            return await cursor.fetchone()
-            creditor_id, credit_amount = creditors[i]
-            debtor_id, debt_amount = debtors[j]
-            
-            # Transfer minimum of what creditor is owed and debtor owes
-            transfer_amount = min(credit_amount, debt_amount)
-            
-            if transfer_amount > 0:
-                # Get user objects
-                async with aiosqlite.connect(self.db_path) as db:
-                    cursor = await db.execute(
-                        "SELECT id, tg_user_id, name, created_at, last_seen FROM users WHERE id IN (?, ?)",
-                        (debtor_id, creditor_id)
-                    )
-                    user_rows = await cursor.fetchall()
-                    user_map = {row[0]: User(*row) for row in user_rows}
-                
-                transactions.append((user_map[debtor_id], user_map[creditor_id], transfer_amount))
-                
-                # Update balances
-                creditors[i] = (creditor_id, credit_amount - transfer_amount)
-                debtors[j] = (debtor_id, debt_amount - transfer_amount)
-            
-            # Move to next creditor/debtor if current one is settled
-            if creditors[i][1] == 0:
-                i += 1
-            if debtors[j][1] == 0:
-                j += 1
-        
-        return transactions
+            preferences = await cursor.fetchone()
+        if preferences is not None:
+            self._payment_preferences.set(user_id, preferences)
+        return preferences
 
     async def mark_participant_paid(self, expense_id: int, participant_id: int, payment_method: str) -> bool:
         """Mark a participant as paid for a group expense."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection(write=True) as db:
             paid_status = True if payment_method == 'paid_now' else False
             await db.execute(
                 """UPDATE group_expense_participants 
@@ -1368,7 +1594,10 @@ class Database:
 
     async def get_expense_by_id(self, expense_id: int) -> dict:
         """Get expense details by ID."""
-        async with aiosqlite.connect(self.db_path) as db:
+        expense = self._expenses_by_id.get(expense_id)
+        if expense is not None:
+            return dict(expense)
+        async with self._connection() as db:
             cursor = await db.execute(
                 """SELECT id, group_id, payer_user_id, amount, currency, description, created_at
                    FROM group_expenses WHERE id = ?""",
@@ -1376,7 +1605,7 @@ class Database:
             )
             row = await cursor.fetchone()
             if row:
-                return {
+                expense = {
                     'id': row[0],
                     'group_id': row[1], 
                     'payer_user_id': row[2],
@@ -1385,62 +1614,37 @@ class Database:
                     'description': row[5],
                     'created_at': row[6]
                 }
+                self._expenses_by_id.set(expense_id, expense)
+                return dict(expense)
             return None
 
     async def get_groups_with_pending_debts(self) -> List[int]:
         """Get all group IDs that have pending debts."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 """SELECT DISTINCT group_id 
                    FROM group_debts 
                    WHERE amount > 0""")
-            rows = await cursor.fetchall()
-            return [row[0] for row in rows]
+            return [row[0] async for row in cursor]
 
     async def get_wallet_transactions(self, wallet_id: int, limit: int = 10):
         """Get recent transactions for a specific wallet."""
-        async with aiosqlite.connect(self.db_path) as db:
-            transactions = []
-            
-            # Get wallet adjustments (top-ups, decreases)
+        async with self._connection() as db:
+            # Merge both histories and take the newest rows in SQL
             cursor = await db.execute("""
-                SELECT delta_amount, reason, created_at, 'adjustment' as type
-                FROM wallet_adjustments 
-                WHERE wallet_id = ?
-                ORDER BY created_at DESC
-                LIMIT ?
-            """, (wallet_id, limit))
-            
-            adjustment_rows = await cursor.fetchall()
-            for row in adjustment_rows:
-                amount, reason, created_at, tx_type = row
-                transactions.append({
-                    'amount': amount,
-                    'description': reason,
-                    'created_at': created_at,
-                    'type': tx_type
-                })
-            
-            # Get personal expenses from this wallet
-            cursor = await db.execute("""
-                SELECT -amount, note, created_at, 'expense' as type
-                FROM personal_expenses 
-                WHERE wallet_id = ?
+                SELECT amount, description, created_at, type FROM (
+                    SELECT delta_amount AS amount, reason AS description, created_at, 'adjustment' AS type
+                    FROM wallet_adjustments
+                    WHERE wallet_id = ?1
+                    UNION ALL
+                    SELECT -amount, COALESCE(note, 'Chi tiêu cá nhân'), created_at, 'expense'
+                    FROM personal_expenses
+                    WHERE wallet_id = ?1
+                )
                 ORDER BY created_at DESC
-                LIMIT ?
+                LIMIT ?2
             """, (wallet_id, limit))
-            
-            expense_rows = await cursor.fetchall()
-            for row in expense_rows:
-                amount, note, created_at, tx_type = row
-                description = note if note else "Chi tiêu cá nhân"
-                transactions.append({
-                    'amount': amount,
-                    'description': description,
-                    'created_at': created_at,
-                    'type': tx_type
-                })
-            
-            # Sort all transactions by date and limit
-            transactions.sort(key=lambda x: x['created_at'], reverse=True)
-            return transactions[:limit]
+            return [
+                {'amount': amount, 'description': description, 'created_at': created_at, 'type': tx_type}
+                async for amount, description, created_at, tx_type in cursor
+            ]
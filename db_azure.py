@@ -4,18 +4,26 @@ This is a hybrid implementation that can use both SQLite (fallback) and Azure SQ
 """
 import asyncio
 import logging
+import aiosqlite
 import pyodbc
 import aioodbc
-import aiosqlite
 from typing import Optional, List, Tuple, Any
 from datetime import datetime, timedelta
 from decimal import Decimal
 
 from config_azure import azure_config
+from db import Database
 from models import *
 
 logger = logging.getLogger(__name__)
 
+# Azure SQL connections kept open for reuse; each new one costs a TCP/TLS/auth handshake
+AZURE_POOL_MINSIZE = 2
+AZURE_POOL_MAXSIZE = 10
+
+# Rows bound per executemany call; all chunks commit together
+AZURE_EXECUTEMANY_CHUNK = 1000
+
 class AzureDatabase:
     """
     Hybrid database class that supports both Azure SQL and SQLite fallback.
@@ -23,18 +31,30 @@ class AzureDatabase:
     
     def __init__(self):
         self.use_azure = azure_config.is_azure_configured and not azure_config.use_sqlite_fallback
+        # Built up front so falling back from Azure reuses it; opens no connection until used
+        self.sqlite_db = Database(azure_config.sqlite_path)
         
         if self.use_azure:
             logger.info("Using Azure SQL Database")
             self.connection_string = azure_config.pyodbc_connection_string
+            self._pool = None
+            self._read_pool = None
+            self._pool_lock = asyncio.Lock()
         else:
             logger.info("Using SQLite fallback")
-            # Import original SQLite database
-            from db import Database
-            self.sqlite_db = Database(azure_config.sqlite_path)
+            self._bind_sqlite_methods()
+    
+    def _bind_sqlite_methods(self):
+        """Bind the SQLite Database's public methods this class lacks onto the instance."""
+        for name in dir(self.sqlite_db):
+            if name.startswith('_') or hasattr(AzureDatabase, name):
+                continue
+            attr = getattr(self.sqlite_db, name)
+            if callable(attr):
+                setattr(self, name, attr)
     
     async def get_connection(self):
-        """Get database connection (Azure SQL or SQLite)."""
+        """Open a new database connection (Azure SQL or SQLite); the caller must close it."""
         if self.use_azure:
             try:
                 return await aioodbc.connect(dsn=self.connection_string)
@@ -43,36 +63,91 @@ class AzureDatabase:
                 # Fallback to SQLite
                 logger.info("Falling back to SQLite")
                 self.use_azure = False
-                from db import Database
-                self.sqlite_db = Database(azure_config.sqlite_path)
-                return await self.sqlite_db.get_connection()
+                self._bind_sqlite_methods()
+        # A separate connection, never the SQLite Database's shared writer: closing it
+        # must not take down the bot's writer, and it sits outside its write lock
+        return await aiosqlite.connect(self.sqlite_db.db_path)
+    
+    async def ensure_pool(self):
+        """Create the Azure SQL connection pools on first use; None once on SQLite."""
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None and self.use_azure:
+                    try:
+                        # Autocommit readers: a SELECT never leaves a transaction open to commit
+                        self._read_pool = await aioodbc.create_pool(
+                            dsn=self.connection_string,
+                            minsize=AZURE_POOL_MINSIZE,
+                            maxsize=AZURE_POOL_MAXSIZE,
+                            autocommit=True,
+                        )
+                        self._pool = await aioodbc.create_pool(
+                            dsn=self.connection_string,
+                            minsize=AZURE_POOL_MINSIZE,
+                            maxsize=AZURE_POOL_MAXSIZE,
+                            autocommit=False,
+                        )
+                    except Exception as e:
+                        logger.error(f"Failed to connect to Azure SQL: {e}")
+                        # Fallback to SQLite
+                        logger.info("Falling back to SQLite")
+                        self.use_azure = False
+                        self._bind_sqlite_methods()
+        return self._pool
+
+    async def close(self):
+        """Close the Azure SQL pools and the SQLite connections."""
+        for attr in ('_read_pool', '_pool'):
+            pool = self.__dict__.get(attr)
+            if pool is not None:
+                pool.close()
+                await pool.wait_closed()
+                setattr(self, attr, None)
+        await self.sqlite_db.close()
+    
+    async def execute_read(self, query: str, params: tuple = None) -> List[tuple]:
+        """Run a SELECT on a read connection and return all rows."""
+        pool = await self.ensure_pool() if self.use_azure else None
+        if pool is not None:
+            async with self._read_pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(query, params or ())
+                    return await cursor.fetchall()
         else:
-            # Use direct aiosqlite connection to avoid relying on missing get_connection()
-            return await aiosqlite.connect(azure_config.sqlite_path)
+            return await self.sqlite_db.execute_read(query, params)
     
     async def execute_query(self, query: str, params: tuple = None) -> Any:
         """Execute a query and return results."""
-        if self.use_azure:
-            async with await self.get_connection() as conn:
+        pool = await self.ensure_pool() if self.use_azure else None
+        if pool is not None:
+            async with pool.acquire() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(query, params or ())
                     if query.strip().upper().startswith('SELECT'):
                         return await cursor.fetchall()
                     else:
+                        # Writes with an OUTPUT clause return rows; read them before committing
+                        rows = await cursor.fetchall() if cursor.description else None
                         await conn.commit()
-                        return cursor.rowcount
+                        return cursor.rowcount if rows is None else rows
         else:
             # Delegate to SQLite database
             return await self.sqlite_db.execute_query(query, params)
     
     async def execute_many(self, query: str, params_list: List[tuple]) -> int:
         """Execute a query multiple times with different parameters."""
-        if self.use_azure:
-            async with await self.get_connection() as conn:
+        pool = await self.ensure_pool() if self.use_azure else None
+        if pool is not None:
+            async with pool.acquire() as conn:
                 async with conn.cursor() as cursor:
-                    await cursor.executemany(query, params_list)
+                    # Let pyodbc send each chunk's parameters as one array instead of a round trip per row
+                    cursor._impl.fast_executemany = True
+                    rowcount = 0
+                    for i in range(0, len(params_list), AZURE_EXECUTEMANY_CHUNK):
+                        await cursor.executemany(query, params_list[i:i + AZURE_EXECUTEMANY_CHUNK])
+                        rowcount += cursor.rowcount
                     await conn.commit()
-                    return cursor.rowcount
+                    return rowcount
         else:
             return await self.sqlite_db.execute_many(query, params_list)
     
@@ -246,6 +321,10 @@ class AzureDatabase:
             FOREIGN KEY (creditor_id) REFERENCES users(id) ON DELETE NO ACTION
         );
         
+        -- Groups that still have outstanding debts
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='idx_gd_group_pending')
+        CREATE INDEX idx_gd_group_pending ON group_debts(group_id) WHERE amount > 0;
+        
         -- Group deductions table
         IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='group_deductions' AND xtype='U')
         CREATE TABLE group_deductions (
@@ -290,16 +369,36 @@ class AzureDatabase:
         );
         """
         
-        # Execute schema creation
-        statements = azure_schema.split(';\n\n')
-        for statement in statements:
-            if statement.strip():
-                try:
-                    await self.execute_query(statement.strip())
-                    logger.info(f"Created table successfully")
-                except Exception as e:
-                    logger.error(f"Error creating table: {e}")
-                    logger.error(f"Statement: {statement[:100]}...")
+        # Send the whole schema as one T-SQL batch on a single connection. Every
+        # object has its own IF NOT EXISTS guard, so if the batch fails it is
+        # safe to rerun statement by statement and report the object at fault.
+        try:
+            pool = await self.ensure_pool()
+            if pool is None:
+                await self.sqlite_db.init_db()
+                return
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    try:
+                        await cursor.execute(azure_schema)
+                        await conn.commit()
+                        logger.info("Created tables successfully")
+                        return
+                    except Exception as e:
+                        logger.warning(f"Schema batch failed ({e}), creating objects one by one")
+                        await conn.rollback()
+                    for statement in azure_schema.split(';'):
+                        if not statement.strip():
+                            continue
+                        try:
+                            await cursor.execute(statement)
+                            await conn.commit()
+                        except Exception as e:
+                            await conn.rollback()
+                            logger.error(f"Error creating table: {e}")
+                            logger.error(f"Statement: {statement.strip()[:100]}...")
+        except Exception as e:
+            logger.error(f"Error creating tables: {e}")
     
     # Delegate all other methods to SQLite implementation or implement Azure versions
     async def get_user_by_tg_id(self, tg_user_id: int) -> Optional[User]:
@@ -309,7 +408,7 @@ class AzureDatabase:
                 "SELECT id, tg_user_id, name, created_at, last_seen "
                 "FROM users WHERE tg_user_id = ?"
             )
-            result = await self.execute_query(query, (tg_user_id,))
+            result = await self.execute_read(query, (tg_user_id,))
             if result:
                 return User(*result[0])
             return None
@@ -323,11 +422,11 @@ class AzureDatabase:
             q = (
                 "SELECT rate FROM exchange_rates WHERE from_currency = ? AND to_currency = ?"
             )
-            rows = await self.execute_query(q, (from_currency, to_currency))
+            rows = await self.execute_read(q, (from_currency, to_currency))
             if rows:
                 return Decimal(str(rows[0][0]))
             # Inverse
-            rows = await self.execute_query(q, (to_currency, from_currency))
+            rows = await self.execute_read(q, (to_currency, from_currency))
             if rows and rows[0][0] not in (None, 0):
                 return Decimal('1') / Decimal(str(rows[0][0]))
             return None
@@ -364,13 +463,10 @@ class AzureDatabase:
                 UPDATE SET name = source.name, last_seen = GETDATE()
             WHEN NOT MATCHED THEN
                 INSERT (tg_user_id, name, created_at, last_seen)
-                VALUES (source.tg_user_id, source.name, GETDATE(), GETDATE());
+                VALUES (source.tg_user_id, source.name, GETDATE(), GETDATE())
+            OUTPUT inserted.id, inserted.tg_user_id, inserted.name, inserted.created_at, inserted.last_seen;
             """
-            await self.execute_query(query, (tg_user_id, name))
-            
-            # Get the user
-            query = "SELECT id, tg_user_id, name, created_at, last_seen FROM users WHERE tg_user_id = ?"
-            result = await self.execute_query(query, (tg_user_id,))
+            result = await self.execute_query(query, (tg_user_id, name))
             if result:
                 return User(*result[0])
         else:
@@ -379,9 +475,9 @@ class AzureDatabase:
     # Add more method implementations as needed...
     # For now, delegate to SQLite for methods not yet implemented
     def __getattr__(self, name):
-        """Delegate unknown methods to SQLite database if available, else raise clearly."""
+        """Delegate unknown methods to SQLite database in SQLite mode, else raise clearly."""
         sqlite_db = self.__dict__.get('sqlite_db')
-        if sqlite_db is not None:
+        if sqlite_db is not None and not self.__dict__.get('use_azure'):
             return getattr(sqlite_db, name)
         raise AttributeError(f"{self.__class__.__name__} has no attribute {name}")
 
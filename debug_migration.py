@@ -17,31 +17,33 @@ def debug_migration():
     print("\n📊 SQLite Data Analysis:")
     print("=" * 40)
     
-    # Check user_wallets
-    cursor.execute("SELECT id, user_id, currency FROM user_wallets")
-    wallets = cursor.fetchall()
-    print(f"👛 user_wallets: {len(wallets)} rows")
-    for wallet in wallets:
-        print(f"  Wallet ID={wallet[0]}, User ID={wallet[1]}, Currency={wallet[2]}")
-    
-    # Check wallet_adjustments
-    cursor.execute("SELECT id, wallet_id, delta_amount, reason FROM wallet_adjustments")
-    adjustments = cursor.fetchall()
-    print(f"🔧 wallet_adjustments: {len(adjustments)} rows")
-    for adj in adjustments:
-        print(f"  Adjustment ID={adj[0]}, Wallet ID={adj[1]}, Amount={adj[2]}, Reason={adj[3]}")
-    
-    # Check FK relationships
+    # Row counts and dangling wallet references in one query
     cursor.execute("""
-        SELECT wa.id, wa.wallet_id, uw.id as wallet_exists
-        FROM wallet_adjustments wa
-        LEFT JOIN user_wallets uw ON wa.wallet_id = uw.id
+        SELECT (SELECT COUNT(*) FROM user_wallets),
+               (SELECT COUNT(*) FROM wallet_adjustments),
+               (SELECT COUNT(*) FROM wallet_adjustments wa
+                LEFT JOIN user_wallets uw ON wa.wallet_id = uw.id
+                WHERE uw.id IS NULL)
     """)
-    fk_check = cursor.fetchall()
+    wallet_count, adjustment_count, broken_count = cursor.fetchone()
+    print(f"👛 user_wallets: {wallet_count} rows")
+    print(f"🔧 wallet_adjustments: {adjustment_count} rows")
+    
+    # Check FK relationships
     print(f"\n🔗 FK Relationship Check:")
-    for row in fk_check:
-        status = "✅ OK" if row[2] else "❌ BROKEN FK"
-        print(f"  Adjustment {row[0]} → Wallet {row[1]} {status}")
+    if broken_count:
+        print(f"  ❌ {broken_count} adjustments reference missing wallets")
+        cursor.execute("""
+            SELECT wa.id, wa.wallet_id
+            FROM wallet_adjustments wa
+            LEFT JOIN user_wallets uw ON wa.wallet_id = uw.id
+            WHERE uw.id IS NULL
+            LIMIT 20
+        """)
+        for adjustment_id, wallet_id in cursor.fetchall():
+            print(f"  Adjustment {adjustment_id} → Wallet {wallet_id} ❌ BROKEN FK")
+    else:
+        print("  ✅ Every adjustment references an existing wallet")
     
     sqlite_conn.close()
     
@@ -55,11 +57,8 @@ def debug_migration():
             cursor = azure_conn.cursor()
             
             # Check user_wallets in Azure
-            cursor.execute("SELECT id, user_id, currency FROM user_wallets")
-            azure_wallets = cursor.fetchall()
-            print(f"👛 Azure user_wallets: {len(azure_wallets)} rows")
-            for wallet in azure_wallets:
-                print(f"  Wallet ID={wallet[0]}, User ID={wallet[1]}, Currency={wallet[2]}")
+            cursor.execute("SELECT COUNT(*) FROM user_wallets")
+            print(f"👛 Azure user_wallets: {cursor.fetchone()[0]} rows")
             
             azure_conn.close()
             
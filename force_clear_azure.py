@@ -39,12 +39,23 @@ def force_clear_database():
             'users'
         ]
         
+        # Note which tables exist so the report only lists what was really dropped
+        cursor.execute(
+            "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME IN ("
+            + ", ".join("?" * len(drop_tables)) + ")",
+            drop_tables
+        )
+        existing = {row[0].lower() for row in cursor.fetchall()}
+        
+        # One batch, one round trip; nothing is committed unless every drop succeeds
+        try:
+            cursor.execute("\n".join(f"DROP TABLE IF EXISTS {table};" for table in drop_tables))
+        except Exception:
+            conn.rollback()
+            raise
         for table in drop_tables:
-            try:
-                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            if table in existing:
                 print(f"✅ Dropped {table}")
-            except Exception as e:
-                print(f"⚠️ Could not drop {table}: {e}")
         
         conn.commit()
         print("✅ All tables dropped successfully!")
@@ -0,0 +1,8 @@
+"""
+Service instances shared by all handler classes.
+"""
+import db
+from services.currency import CurrencyService
+
+# Built once at import so every handler call reuses the same HTTP client
+CURRENCY_SERVICE = CurrencyService(db)
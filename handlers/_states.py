@@ -0,0 +1,28 @@
+"""
+Conversation state kept per user while the bot waits for text input.
+"""
+from dataclasses import dataclass
+from enum import IntEnum
+
+
+class Action(IntEnum):
+    ADD_BANK_ACCOUNT = 1
+    SET_EXCHANGE_RATE = 2
+
+
+class Step(IntEnum):
+    ACCOUNT_NUMBER = 1
+    ACCOUNT_NAME = 2
+    RATE = 3
+
+
+@dataclass(slots=True)
+class UserState:
+    """Pending text input for one user"""
+    action: Action
+    step: Step
+    bank_code: str = ''
+    bank_name: str = ''
+    account_number: str = ''
+    from_currency: str = ''
+    to_currency: str = ''
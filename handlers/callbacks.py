@@ -9,6 +9,8 @@ from telegram.ext import ContextTypes
 
 import db
 from keyboards import Keyboards
+from handlers._services import CURRENCY_SERVICE
+from handlers._states import Action, Step, UserState
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +20,19 @@ class CallbackHandlers:
     def __init__(self, user_states, group_expense_states):
         self.user_states = user_states
         self.group_expense_states = group_expense_states
+        # Exact callback data -> handler(query, user_id)
+        self._exact_routes = {
+            'main_menu': self._handle_main_menu,
+            'budget_menu': self._handle_budget_menu,
+            'settings_menu': self._handle_settings_menu,
+            'payment_settings': self._handle_payment_settings,
+            'personal_expense_menu': self._handle_personal_expense_menu,
+        }
+        # Callback data prefix -> handler(query, user_id, rest of the data)
+        self._prefix_routes = (
+            ('select_bank_', self._handle_bank_selection),
+            ('group_currency_', self._handle_group_currency),
+        )
 
     async def handle_callback_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Main callback query router"""
@@ -25,28 +40,21 @@ class CallbackHandlers:
         data = query.data
         user_id = update.effective_user.id
         
-        logger.info(f"Processing callback query: {data} from user {user_id}")
+        logger.info("Processing callback query: %s from user %s", data, user_id)
         
         await query.answer()
         
         # Route to appropriate handler
-        if data == 'main_menu':
-            await self._handle_main_menu(query, user_id)
-        elif data == 'budget_menu':
-            await self._handle_budget_menu(query, user_id)
-        elif data == 'settings_menu':
-            await self._handle_settings_menu(query, user_id)
-        elif data == 'payment_settings':
-            await self._handle_payment_settings(query, user_id)
-        elif data.startswith('select_bank_'):
-            await self._handle_bank_selection(query, user_id, data)
-        elif data.startswith('group_currency_'):
-            await self._handle_group_currency(query, user_id, data)
-        elif data == 'personal_expense_menu':
-            await self._handle_personal_expense_menu(query, user_id)
+        handler = self._exact_routes.get(data)
+        if handler is not None:
+            await handler(query, user_id)
+            return
+        for prefix, handler in self._prefix_routes:
+            if data.startswith(prefix):
+                await handler(query, user_id, data[len(prefix):])
+                return
         # Add more routing as needed...
-        else:
-            await query.edit_message_text("❌ Lệnh không được hỗ trợ")
+        await query.edit_message_text("❌ Lệnh không được hỗ trợ")
 
     async def _handle_main_menu(self, query, user_id):
         """Handle main menu callback"""
@@ -76,9 +84,7 @@ class CallbackHandlers:
         
         text = "💰 **Quản lý Budget**\n\n"
         if wallets:
-            # Initialize currency service
-            from services.currency import CurrencyService
-            currency_service = CurrencyService(db)
+            currency_service = CURRENCY_SERVICE
             
             text += "Ví hiện tại:\n"
             for wallet in wallets:
@@ -108,33 +114,31 @@ class CallbackHandlers:
         """Handle payment settings callback"""
         # Get user preferences
         db_user = await db.get_user_by_tg_id(user_id)
-        preferences = await db.get_payment_preferences(db_user.id)
+        accept_vnd, accounts = await db.get_payment_settings(db_user.id)
         
-        accept_vnd = preferences[0] if preferences else False
-        
-        text = "💳 **Cài đặt thanh toán**\n\n"
-        text += f"💰 Nhận VND: {'✅ Bật' if accept_vnd else '❌ Tắt'}\n\n"
+        parts = [
+            "💳 **Cài đặt thanh toán**\n\n",
+            f"💰 Nhận VND: {'✅ Bật' if accept_vnd else '❌ Tắt'}\n\n",
+        ]
         
         if accept_vnd:
             # Show bank accounts
-            accounts = await db.get_user_bank_accounts(db_user.id)
             if accounts:
-                text += "🏛️ Tài khoản ngân hàng:\n"
+                parts.append("🏛️ Tài khoản ngân hàng:\n")
                 for account in accounts:
-                    default_text = " (mặc định)" if account[4] else ""  # is_default
-                    text += f"• {account[2]} - {account[3]}{default_text}\n"  # bank_name, account_number
+                    default_text = " (mặc định)" if account.is_default else ""
+                    parts.append(f"• {account.bank_name} - {account.account_number}{default_text}\n")
             else:
-                text += "⚠️ Chưa có tài khoản ngân hàng nào"
+                parts.append("⚠️ Chưa có tài khoản ngân hàng nào")
         
         await query.edit_message_text(
-            text,
+            "".join(parts),
             parse_mode='Markdown',
             reply_markup=Keyboards.payment_settings_menu(accept_vnd)
         )
 
-    async def _handle_bank_selection(self, query, user_id, data):
+    async def _handle_bank_selection(self, query, user_id, bank_code):
         """Handle bank selection callback"""
-        bank_code = data.replace('select_bank_', '')
         
         # Get bank info from VietQR service
         from services.vietqr import VIETNAM_BANKS
@@ -145,11 +149,12 @@ class CallbackHandlers:
         bank_name = VIETNAM_BANKS[bank_code]
         
         # Set user state for account input
-        self.user_states[user_id] = {
-            'action': 'add_bank_account',
-            'bank_code': bank_code,
-            'bank_name': bank_name
-        }
+        self.user_states[user_id] = UserState(
+            action=Action.ADD_BANK_ACCOUNT,
+            step=Step.ACCOUNT_NUMBER,
+            bank_code=bank_code,
+            bank_name=bank_name
+        )
         
         await query.edit_message_text(
             f"🏛️ **{bank_name}**\n\n"
@@ -157,9 +162,8 @@ class CallbackHandlers:
             parse_mode='Markdown'
         )
 
-    async def _handle_group_currency(self, query, user_id, data):
+    async def _handle_group_currency(self, query, user_id, currency):
         """Handle group currency selection"""
-        currency = data.replace('group_currency_', '')
         chat_id = query.message.chat.id
         
         # Store group expense state
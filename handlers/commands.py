@@ -9,6 +9,7 @@ from telegram.ext import ContextTypes
 
 import db
 from keyboards import Keyboards
+from handlers._services import CURRENCY_SERVICE
 
 logger = logging.getLogger(__name__)
 
@@ -21,8 +22,7 @@ class CommandHandlers:
     async def _get_currency_service(self):
         """Lazy initialize currency service"""
         if self.currency_service is None:
-            from services.currency import CurrencyService
-            self.currency_service = CurrencyService(db)
+            self.currency_service = CURRENCY_SERVICE
         return self.currency_service
     
     @staticmethod
@@ -100,9 +100,7 @@ class CommandHandlers:
         wallets = await db.get_user_wallets(db_user.id)
         text = "💰 Quản lý Budget\n\n"
         if wallets:
-            # Initialize currency service
-            from services.currency import CurrencyService
-            currency_service = CurrencyService(db)
+            currency_service = CURRENCY_SERVICE
             
             text += "Ví hiện tại:\n"
             for wallet in wallets:
@@ -11,24 +11,36 @@ from telegram.ext import ContextTypes
 
 import db
 from keyboards import Keyboards
+from handlers._services import CURRENCY_SERVICE
+from handlers._states import Action, Step
 
 logger = logging.getLogger(__name__)
 
+# Expense format: number + optional description, e.g. '120 ăn sáng'
+EXPENSE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*(.*)$')
+
 class MessageHandlers:
     """Handles all text message processing"""
     
     def __init__(self, user_states, group_expense_states):
         self.user_states = user_states
         self.group_expense_states = group_expense_states
+        # (action, step) -> handler(update, user_id, text, state)
+        self._state_routes = {
+            (Action.ADD_BANK_ACCOUNT, Step.ACCOUNT_NUMBER): self._handle_bank_account_number,
+            (Action.ADD_BANK_ACCOUNT, Step.ACCOUNT_NAME): self._handle_bank_account_name,
+            (Action.SET_EXCHANGE_RATE, Step.RATE): self._handle_exchange_rate_input,
+        }
 
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Main message handler router"""
         user_id = update.effective_user.id
         text = update.message.text.strip()
         
-        logger.info(f"Received message from user {user_id}: '{text}'")
-        logger.info(f"Current user_states: {self.user_states}")
-        logger.info(f"Current group_expense_states: {self.group_expense_states}")
+        logger.info("Received message from user %s: %r", user_id, text)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Current user_states: %s", self.user_states)
+            logger.debug("Current group_expense_states: %s", self.group_expense_states)
         
         # Check if user has active state
         if user_id in self.user_states:
@@ -47,15 +59,9 @@ class MessageHandlers:
     async def _handle_user_state(self, update, user_id, text):
         """Handle user in specific state (waiting for input)"""
         state = self.user_states[user_id]
-        action = state.get('action')
-        
-        if action == 'add_bank_account' and state.get('step') == 'account_name':
-            await self._handle_bank_account_name(update, user_id, text, state)
-        elif action == 'add_bank_account':
-            await self._handle_bank_account_number(update, user_id, text, state)
-        elif action == 'set_exchange_rate':
-            await self._handle_exchange_rate_input(update, user_id, text, state)
-        # Add more state handlers as needed...
+        handler = self._state_routes.get((state.action, state.step))
+        if handler:
+            await handler(update, user_id, text, state)
 
     async def _handle_bank_account_name(self, update, user_id, text, state):
         """Handle bank account name input"""
@@ -70,16 +76,16 @@ class MessageHandlers:
             db_user = await db.get_user_by_tg_id(user_id)
             account_id = await db.add_bank_account(
                 db_user.id,
-                state['bank_code'],
-                state['bank_name'],
-                state['account_number'],
+                state.bank_code,
+                state.bank_name,
+                state.account_number,
                 account_name
             )
             
             await update.message.reply_text(
                 f"✅ **Thêm tài khoản thành công!**\n\n"
-                f"🏛️ Ngân hàng: {state['bank_name']}\n"
-                f"💳 STK: {state['account_number']}\n"
+                f"🏛️ Ngân hàng: {state.bank_name}\n"
+                f"💳 STK: {state.account_number}\n"
                 f"👤 Tên: {account_name}\n\n"
                 "Bạn có thể nhận chuyển khoản VND từ bây giờ!",
                 parse_mode='Markdown',
@@ -106,11 +112,11 @@ class MessageHandlers:
             await update.message.reply_text("❌ Số tài khoản không hợp lệ! Vui lòng nhập lại (6-19 chữ số):")
             return
         
-        state['account_number'] = account_number
-        state['step'] = 'account_name'
+        state.account_number = account_number
+        state.step = Step.ACCOUNT_NAME
         
         await update.message.reply_text(
-            f"🏛️ **Tài khoản {state['bank_name']}**\n"
+            f"🏛️ **Tài khoản {state.bank_name}**\n"
             f"💳 STK: {account_number}\n\n"
             "👤 Vui lòng nhập tên chủ tài khoản (như trên thẻ):",
             parse_mode='Markdown'
@@ -130,8 +136,8 @@ class MessageHandlers:
                 await update.message.reply_text("❌ Tỷ giá phải lớn hơn 0! Vui lòng nhập lại:")
                 return
             
-            from_currency = state['from_currency']
-            to_currency = state['to_currency']
+            from_currency = state.from_currency
+            to_currency = state.to_currency
             
             # Save exchange rate
             await db.set_exchange_rate(from_currency, to_currency, rate, user_id)
@@ -155,9 +161,10 @@ class MessageHandlers:
 
     async def _handle_expense_format(self, update, text):
         """Handle expense format like '120 ăn sáng'"""
-        # Pattern: number + optional description
-        expense_pattern = r'^(\d+(?:\.\d+)?)\s*(.*)$'
-        match = re.match(expense_pattern, text)
+        # Most messages don't start with a digit; skip the regex for them
+        if not text or not text[0].isdigit():
+            return
+        match = EXPENSE_PATTERN.match(text)
         
         if not match:
             return  # Not an expense format
@@ -204,27 +211,24 @@ class MessageHandlers:
                 new_balance = Decimal(wallet.current_balance) - amount
                 await db.update_wallet_balance(wallet.id, new_balance)
                 
-                # Initialize currency service
-                from services.currency import CurrencyService
-                currency_service = CurrencyService(db)
+                currency_service = CURRENCY_SERVICE
                 
                 # Format response
                 formatted_amount = currency_service.format_amount(amount, currency)
                 formatted_balance = currency_service.format_amount(new_balance, currency)
                 
-                message = f"✅ Đã ghi nhận chi tiêu {formatted_amount}"
+                parts = [f"✅ Đã ghi nhận chi tiêu {formatted_amount}"]
                 if note:
-                    message += f"\n📝 Ghi chú: {note}"
-                message += f"\n💰 Số dư còn lại: {formatted_balance}"
-                message += f"\n⏰ Có thể hoàn tác trong 10 phút"
+                    parts.append(f"📝 Ghi chú: {note}")
+                parts.append(f"💰 Số dư còn lại: {formatted_balance}")
+                parts.append("⏰ Có thể hoàn tác trong 10 phút")
                 
-                await update.message.reply_text(message)
+                await update.message.reply_text("\n".join(parts))
             else:
                 await update.message.reply_text("❌ Lỗi khi cập nhật ví!")
         else:
             # No wallet - offer to create
-            from services.currency import CurrencyService
-            currency_service = CurrencyService(db)
+            currency_service = CURRENCY_SERVICE
             formatted_amount = currency_service.format_amount(amount, currency)
             await update.message.reply_text(
                 f"❌ Không có ví {currency}!\n\n"
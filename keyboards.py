@@ -5,56 +5,97 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from typing import List, Optional
 from models import UserWallet, User
 
+# Menus without per-user content are built once at import; the markup
+# objects are immutable, so every call returns the same instance.
+_MAIN_DM_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💰 Quản lý ví", callback_data="budget_menu")],
+    [InlineKeyboardButton("💸 Chi tiêu cá nhân", callback_data="personal_expense_menu")],
+    [InlineKeyboardButton("⚙️ Cài đặt", callback_data="settings_menu"), 
+     InlineKeyboardButton("❓ Trợ giúp", callback_data="help_menu")]
+])
+
+_BUDGET_MENU = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("➕ Tạo ví mới", callback_data="create_wallet"),
+        InlineKeyboardButton("💰 Nạp tiền", callback_data="topup_wallet")
+    ],
+    [
+        InlineKeyboardButton("💸 Rút tiền", callback_data="decrease_wallet"),
+        InlineKeyboardButton("🗑️ Xóa ví", callback_data="delete_wallet")
+    ],
+    [InlineKeyboardButton("📊 Chi tiết ví", callback_data="wallet_details")],
+    [InlineKeyboardButton("🔙 Quay lại", callback_data="main_menu")]
+])
+
+_PERSONAL_EXPENSE_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("➕ Thêm chi tiêu", callback_data="add_personal_expense")],
+    [InlineKeyboardButton("📊 Lịch sử (7 ngày)", callback_data="expense_history_7")],
+    [InlineKeyboardButton("🔄 Hoàn tác giao dịch", callback_data="undo_expense")],
+    [InlineKeyboardButton("🔙 Quay lại", callback_data="main_menu")]
+])
+
+_SETTINGS_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🏦 Quản lý tài khoản", callback_data="bank_account_menu")],
+    [InlineKeyboardButton("💱 Cài đặt tiền tệ", callback_data="currency_settings")],
+    [InlineKeyboardButton("🔙 Quay lại", callback_data="main_menu")]
+])
+
+_GROUP_MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💸 Thêm chi tiêu nhóm", callback_data="add_group_expense")],
+    [InlineKeyboardButton("📊 Tổng quan chi tiêu", callback_data="group_overview")],
+    [InlineKeyboardButton("🔄 Hoàn tác giao dịch", callback_data="undo_group_expense_menu")]
+])
+
+_ADMIN_EXCHANGE_RATE_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📈 Xem tỷ giá hiện tại", callback_data="view_rates")],
+    [InlineKeyboardButton("💱 Cập nhật TWD/VND", callback_data="set_twd_vnd_rate")],
+    [InlineKeyboardButton("💲 Cập nhật USD/VND", callback_data="set_usd_vnd_rate")],
+    [InlineKeyboardButton("⚙️ Tỷ giá khác", callback_data="set_custom_rate")],
+    [InlineKeyboardButton("🔙 Quay lại", callback_data="main_menu")]
+])
+
+_GROUP_EXPENSE_CURRENCY_SELECTION = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🇹🇼 TWD", callback_data="group_currency_TWD")],
+    [InlineKeyboardButton("🇺🇸 USD", callback_data="group_currency_USD")],
+    [InlineKeyboardButton("🇪🇺 EUR", callback_data="group_currency_EUR")],
+    [InlineKeyboardButton("🇻🇳 VND", callback_data="group_currency_VND")],
+    [InlineKeyboardButton("❌ Hủy", callback_data="cancel_group_expense")]
+])
+
+
+def _payment_settings_menu(accept_vnd: bool) -> InlineKeyboardMarkup:
+    vnd_emoji = "✅" if accept_vnd else "☐"
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"{vnd_emoji} 🇻🇳 Nhận chuyển khoản VND", callback_data="toggle_accept_vnd")],
+        [InlineKeyboardButton("🔄 Tự động chuyển đổi nợ", callback_data="toggle_auto_convert")],
+        [InlineKeyboardButton("🔙 Quay lại", callback_data="settings_menu")]
+    ])
+
+
+_PAYMENT_MENU_ON = _payment_settings_menu(True)
+_PAYMENT_MENU_OFF = _payment_settings_menu(False)
+
 
 class Keyboards:
     @staticmethod
     def main_dm_menu() -> InlineKeyboardMarkup:
         """Main menu for DM conversations."""
-        keyboard = [
-            [InlineKeyboardButton("💰 Quản lý ví", callback_data="budget_menu")],
-            [InlineKeyboardButton("💸 Chi tiêu cá nhân", callback_data="personal_expense_menu")],
-            [InlineKeyboardButton("⚙️ Cài đặt", callback_data="settings_menu"), 
-             InlineKeyboardButton("❓ Trợ giúp", callback_data="help_menu")]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return _MAIN_DM_MENU
 
     @staticmethod
     def budget_menu() -> InlineKeyboardMarkup:
         """Budget management menu."""
-        keyboard = [
-            [
-                InlineKeyboardButton("➕ Tạo ví mới", callback_data="create_wallet"),
-                InlineKeyboardButton("💰 Nạp tiền", callback_data="topup_wallet")
-            ],
-            [
-                InlineKeyboardButton("💸 Rút tiền", callback_data="decrease_wallet"),
-                InlineKeyboardButton("🗑️ Xóa ví", callback_data="delete_wallet")
-            ],
-            [InlineKeyboardButton("📊 Chi tiết ví", callback_data="wallet_details")],
-            [InlineKeyboardButton("🔙 Quay lại", callback_data="main_menu")]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return _BUDGET_MENU
 
     @staticmethod
     def personal_expense_menu() -> InlineKeyboardMarkup:
         """Personal expense menu."""
-        keyboard = [
-            [InlineKeyboardButton("➕ Thêm chi tiêu", callback_data="add_personal_expense")],
-            [InlineKeyboardButton("📊 Lịch sử (7 ngày)", callback_data="expense_history_7")],
-            [InlineKeyboardButton("🔄 Hoàn tác giao dịch", callback_data="undo_expense")],
-            [InlineKeyboardButton("🔙 Quay lại", callback_data="main_menu")]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return _PERSONAL_EXPENSE_MENU
 
     @staticmethod
     def settings_menu() -> InlineKeyboardMarkup:
         """Settings menu."""
-        keyboard = [
-            [InlineKeyboardButton("🏦 Quản lý tài khoản", callback_data="bank_account_menu")],
-            [InlineKeyboardButton("💱 Cài đặt tiền tệ", callback_data="currency_settings")],
-            [InlineKeyboardButton("🔙 Quay lại", callback_data="main_menu")]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return _SETTINGS_MENU
 
     @staticmethod
     def currency_selection() -> InlineKeyboardMarkup:
@@ -108,12 +149,7 @@ class Keyboards:
     @staticmethod
     def group_main_menu() -> InlineKeyboardMarkup:
         """Main menu for group conversations."""
-        keyboard = [
-            [InlineKeyboardButton("💸 Thêm chi tiêu nhóm", callback_data="add_group_expense")],
-            [InlineKeyboardButton("📊 Tổng quan chi tiêu", callback_data="group_overview")],
-            [InlineKeyboardButton("🔄 Hoàn tác giao dịch", callback_data="undo_group_expense_menu")]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return _GROUP_MAIN_MENU
 
     @staticmethod
     def participant_selection(members: List[User], selected: List[int] = None) -> InlineKeyboardMarkup:
@@ -343,19 +379,7 @@ class Keyboards:
     @staticmethod
     def group_expense_currency_selection() -> InlineKeyboardMarkup:
         """Currency selection for group expenses."""
-        currencies = [
-            ("TWD", "🇹🇼 TWD"),
-            ("USD", "🇺🇸 USD"),
-            ("EUR", "🇪🇺 EUR"),
-            ("VND", "🇻🇳 VND")
-        ]
-        
-        keyboard = []
-        for code, display in currencies:
-            keyboard.append([InlineKeyboardButton(display, callback_data=f"group_currency_{code}")])
-        
-        keyboard.append([InlineKeyboardButton("❌ Hủy", callback_data="cancel_group_expense")])
-        return InlineKeyboardMarkup(keyboard)
+        return _GROUP_EXPENSE_CURRENCY_SELECTION
 
     @staticmethod
     def group_participant_selection(chat_members: List, selected: List[int] = None) -> InlineKeyboardMarkup:
@@ -469,14 +493,9 @@ class Keyboards:
         return menu
 
     @staticmethod
-    def payment_settings_menu() -> InlineKeyboardMarkup:
+    def payment_settings_menu(accept_vnd: bool = False) -> InlineKeyboardMarkup:
         """Payment settings menu."""
-        keyboard = [
-            [InlineKeyboardButton("🇻🇳 Nhận chuyển khoản VND", callback_data="toggle_accept_vnd")],
-            [InlineKeyboardButton("🔄 Tự động chuyển đổi nợ", callback_data="toggle_auto_convert")],
-            [InlineKeyboardButton("🔙 Quay lại", callback_data="settings_menu")]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return _PAYMENT_MENU_ON if accept_vnd else _PAYMENT_MENU_OFF
 
     @staticmethod
     def bank_selection() -> InlineKeyboardMarkup:
@@ -594,14 +613,7 @@ class Keyboards:
     @staticmethod
     def admin_exchange_rate_menu() -> InlineKeyboardMarkup:
         """Admin menu for exchange rate management."""
-        keyboard = [
-            [InlineKeyboardButton("📈 Xem tỷ giá hiện tại", callback_data="view_rates")],
-            [InlineKeyboardButton("💱 Cập nhật TWD/VND", callback_data="set_twd_vnd_rate")],
-            [InlineKeyboardButton("💲 Cập nhật USD/VND", callback_data="set_usd_vnd_rate")],
-            [InlineKeyboardButton("⚙️ Tỷ giá khác", callback_data="set_custom_rate")],
-            [InlineKeyboardButton("🔙 Quay lại", callback_data="main_menu")]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return _ADMIN_EXCHANGE_RATE_MENU
 
     @staticmethod
     def back_to_main_menu() -> InlineKeyboardMarkup:
@@ -6,17 +6,20 @@ import asyncio
 import logging
 import string
 import random
+import weakref
+from collections import OrderedDict
 from decimal import Decimal, InvalidOperation
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 
 from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup, BotCommandScopeAllPrivateChats, BotCommandScopeAllGroupChats
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 from telegram.error import TelegramError, TimedOut, NetworkError
 from telegram.request import HTTPXRequest
 import pytz
 import asyncio
 from datetime import datetime, time
+from time import monotonic
 
 from db import Database
 from models import *
@@ -49,6 +52,14 @@ WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
 WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
 WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
 
+# Multi-step flow state: abandoned flows expire after this idle time, and the
+# least recently used entries go first past the size bound
+STATE_MAX_ENTRIES = 10_000
+STATE_TTL_SECONDS = 15 * 60
+
+# Updates handled at once across all chats; matches the HTTP connection pool below
+MAX_CONCURRENT_UPDATES = 16
+
 # Global instances
 db = Database(DATABASE_PATH)
 currency_service = CurrencyService(db)
@@ -56,9 +67,98 @@ settlement_service = SettlementService()
 deduction_service = DeductionService(db, currency_service)
 vietqr_service = VietQRService(db)
 
+class ConversationStates(dict):
+    """Dict of per-user/per-chat flow state that forgets idle and least recently used entries."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._last_used: OrderedDict = OrderedDict()  # key -> monotonic time, oldest first
+
+    def _touch(self, key) -> None:
+        self._last_used[key] = monotonic()
+        self._last_used.move_to_end(key)
+
+    def _expire(self) -> None:
+        deadline = monotonic() - self.ttl
+        while self._last_used:
+            key, used = next(iter(self._last_used.items()))
+            if used >= deadline:
+                break
+            self.__delitem__(key)
+
+    def __setitem__(self, key, value) -> None:
+        self._expire()
+        super().__setitem__(key, value)
+        self._touch(key)
+        while len(self) > self.maxsize:
+            self.__delitem__(next(iter(self._last_used)))
+
+    def __getitem__(self, key):
+        # No expiry pass here: a key an `in` check just found must still be readable
+        value = super().__getitem__(key)
+        self._touch(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        # A membership check isn't activity: refreshing here would keep an abandoned
+        # flow alive for as long as the user keeps sending unrelated messages
+        self._expire()
+        return super().__contains__(key)
+
+    def __delitem__(self, key) -> None:
+        super().__delitem__(key)
+        del self._last_used[key]
+
+    def get(self, key, default=None):
+        # Expire, then a single lookup that refreshes the entry it finds
+        self._expire()
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        self._last_used.pop(key, None)
+        return super().pop(key, *default)
+
+
 # User state tracking for multi-step operations
-user_states: Dict[int, Dict] = {}
-group_expense_states: Dict[int, Dict] = {}  # For group expense creation states
+user_states: Dict[int, Dict] = ConversationStates(STATE_MAX_ENTRIES, STATE_TTL_SECONDS)
+group_expense_states: Dict[int, Dict] = ConversationStates(STATE_MAX_ENTRIES, STATE_TTL_SECONDS)  # For group expense creation states
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Handle updates from different chats concurrently, but each chat's updates in order."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # A chat's lock lives only while that chat has updates in flight
+        self._chat_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    async def process_update(self, update: object, coroutine) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            # Nothing to keep in order with
+            await super().process_update(update, coroutine)
+            return
+        lock = self._chat_locks.get(chat.id)
+        if lock is None:
+            lock = self._chat_locks[chat.id] = asyncio.Lock()
+        # Wait for the chat's turn before taking a concurrency slot, so a
+        # busy chat's queued updates can't hold every slot while they wait
+        async with lock:
+            await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -516,22 +616,20 @@ class BotHandlers:
         wallet = await db.get_wallet_by_currency(user_id, currency)
         
         if wallet:
-            # Deduct from wallet (negative balance is now always allowed)
-            success = await db.update_wallet_balance(wallet.id, -amount, "Chi tiêu cá nhân")
-            if success:
-                # Add expense record
-                expense = await db.add_personal_expense(user_id, amount, currency, wallet.id, note)
+            # Add expense record and deduct from wallet (negative balance is now always allowed)
+            expense = await db.add_personal_expense_and_debit(user_id, amount, currency, wallet.id, note)
+            if expense:
                 formatted_amount = currency_service.format_amount(amount, currency)
                 remaining_balance = Decimal(wallet.current_balance) - amount
                 formatted_balance = currency_service.format_amount(remaining_balance, currency)
                 
-                message = f"✅ Đã ghi nhận chi tiêu {formatted_amount}"
+                parts = [f"✅ Đã ghi nhận chi tiêu {formatted_amount}"]
                 if note:
-                    message += f"\n📝 Ghi chú: {note}"
-                message += f"\n💰 Số dư còn lại: {formatted_balance}"
-                message += f"\n⏰ Có thể hoàn tác trong 10 phút"
+                    parts.append(f"📝 Ghi chú: {note}")
+                parts.append(f"💰 Số dư còn lại: {formatted_balance}")
+                parts.append("⏰ Có thể hoàn tác trong 10 phút")
                 
-                await reply_func(message)
+                await reply_func("\n".join(parts))
             else:
                 await reply_func("❌ Lỗi khi cập nhật ví!")
         else:
@@ -1457,7 +1555,7 @@ class BotHandlers:
         data = query.data
         user_id = query.from_user.id
         
-        logger.info(f"Processing callback query: {data} from user {user_id}")
+        logger.info("Processing callback query: %s from user %s", data, user_id)
         
         try:
             await query.answer()
@@ -3335,20 +3433,20 @@ class BotHandlers:
                         await query.answer("❌ Chưa chọn người tham gia!", show_alert=True)
                         return
                     
-                    # Create group expense
-                    expense_id = await db.create_group_expense(
+                    # Calculate equal shares
+                    share_amount = state['amount'] / len(selected)
+                    participants = [(user_id, share_amount) for user_id in selected]
+                    
+                    # Create group expense together with its participants
+                    expense_id = await db.create_group_expense_with_participants(
                         state['group_id'],
                         state['payer_id'], 
                         state['amount'],
                         state['currency'],
-                        state.get('description')
+                        state.get('description'),
+                        participants
                     )
                     
-                    # Calculate equal shares
-                    share_amount = state['amount'] / len(selected)
-                    participants = [(user_id, share_amount) for user_id in selected]
-                    await db.add_expense_participants(expense_id, participants)
-                    
                     # Get payer name properly
                     try:
                         payer_member = await context.bot.get_chat_member(state['group_id'], state['payer_id'])
@@ -3577,13 +3675,14 @@ class BotHandlers:
         user_id = update.effective_user.id
         text = update.message.text.strip()
         
-        logger.info(f"Received message from user {user_id}: '{text}'")
-        logger.info(f"Current user_states: {user_states}")
-        logger.info(f"Current group_expense_states: {group_expense_states}")
+        logger.info("Received message from user %s: %r", user_id, text)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Current user_states: %s", user_states)
+            logger.debug("Current group_expense_states: %s", group_expense_states)
         
         # Check for group expense state first (only in group chats)
-        if user_id in group_expense_states and update.effective_chat.type in ['group', 'supergroup']:
-            state = group_expense_states[user_id]
+        state = group_expense_states.get(user_id) if update.effective_chat.type in ['group', 'supergroup'] else None
+        if state is not None:
             if state.get('step') == 'amount':
                 try:
                     # Parse amount and description like "120 ăn sáng"
@@ -3698,11 +3797,11 @@ class BotHandlers:
                 # Not a valid expense format, ignore
                 pass
         
-        if user_id not in user_states:
+        state = user_states.get(user_id)
+        if state is None:
             logger.info(f"User {user_id} not in user_states, ignoring message")
             return
 
-        state = user_states[user_id]
         action = state.get('action')
 
         try:
@@ -3795,14 +3894,14 @@ class BotHandlers:
                     wallet_id = state['wallet_id']
                     wallet = await db.get_wallet(wallet_id)
                     
-                    # Create expense record with description
+                    # Create expense record with description and update wallet balance
                     db_user = await db.get_user_by_tg_id(user_id)
-                    expense = await db.add_personal_expense(db_user.id, amount, wallet.currency, wallet_id, description)
-                    
-                    # Update wallet balance
-                    success = await db.update_wallet_balance(wallet_id, -amount, f"Chi tiêu: {description}")
+                    expense = await db.add_personal_expense_and_debit(
+                        db_user.id, amount, wallet.currency, wallet_id, description,
+                        reason=f"Chi tiêu: {description}"
+                    )
                     
-                    if success:
+                    if expense:
                         # Get updated wallet info
                         updated_wallet = await db.get_wallet(wallet_id)
                         remaining_balance = Decimal(updated_wallet.current_balance)
@@ -3834,7 +3933,7 @@ class BotHandlers:
                         )
                         logger.info(f"Expense recorded successfully for user {user_id}: {amount} {wallet.currency} for '{description}'")
                     else:
-                        await update.message.reply_text("❌ Không đủ số dư trong ví! Chi tiêu đã được ghi nhận nhưng ví âm quỹ.")
+                        await update.message.reply_text("❌ Lỗi khi cập nhật ví!")
                     
                     del user_states[user_id]
                     
@@ -4155,7 +4254,14 @@ def main():
         connect_timeout=3,
         pool_timeout=5
     )
-    application = Application.builder().token(BOT_TOKEN).request(request).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(request)
+        # A slow database or Telegram call in one chat no longer holds up every other chat
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .build()
+    )
 
     # Add handlers
     application.add_handler(CommandHandler("start", BotHandlers.start_command))
@@ -4230,6 +4336,7 @@ def main():
 
     async def post_stop(application: Application):
         await currency_service.close()
+        await db.close()
         logger.info("Bot stopped")
 
     application.post_init = post_init
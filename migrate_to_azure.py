@@ -103,6 +103,8 @@ class SQLiteToAzureMigrator:
             # Prepare Azure SQL insert
             azure_conn = self.get_azure_connection()
             azure_cursor = azure_conn.cursor()
+            # Send each batch's parameters in one round trip instead of one per row
+            azure_cursor.fast_executemany = True
             
             # Build insert query
             # For tables with IDENTITY, we preserve original IDs to keep FK references valid
@@ -236,6 +238,7 @@ class SQLiteToAzureMigrator:
             return
 
         # Insert with IDENTITY_INSERT
+        a_cur.fast_executemany = True
         a_cur.execute("SET IDENTITY_INSERT wallet_adjustments ON")
         a_cur.executemany(
             "INSERT INTO wallet_adjustments (id, wallet_id, delta_amount, reason, created_at) VALUES (?, ?, ?, ?, ?)",
@@ -132,6 +132,26 @@ class GroupExpense:
     settled: bool = False
 
 
+@dataclass(slots=True)
+class GroupExpenseRow:
+    """A payer's group expense as listed for undo"""
+    id: int
+    amount: Decimal
+    currency: str
+    description: Optional[str]
+    payer_id: int
+    created_at: str  # Local (UTC+7) timestamp text
+    undo_until: Optional[datetime]
+
+
+@dataclass(slots=True)
+class BankAccountSummary:
+    """A bank account as listed on the payment settings screen"""
+    bank_name: str
+    account_number: str
+    is_default: bool
+
+
 @dataclass  
 class GroupExpenseParticipant:
     """Participants in a group expense"""